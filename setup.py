@@ -19,5 +19,9 @@ setup(
     keywords='ueye camera ids pyueye',
     packages=find_packages(exclude=['contrib', 'docs', 'tests', 'samples']),
     install_requires=['pyueye', 'opencv-python', 'numpy'],
-    extras_require={},
+    extras_require={
+        'turbojpeg': ['PyTurboJPEG'],
+        'qoi': ['qoi'],
+        'parquet': ['pyarrow'],
+    },
 )
\ No newline at end of file
@@ -1,8 +1,9 @@
 from pyueye import ueye
-from typing import List
+from typing import List, Optional
 from .exceptions import UEyeError
 from .image_buffer import ImageBuffer
 from .image_data import ImageData
+from .metrics import metrics
 from .rect import Rect
 from .utils import get_bits_per_pixel
 
@@ -11,6 +12,20 @@ class Camera:
     """
     Camera class.
     """
+    # Order in which the recorded settings are applied again
+    CONFIG_ORDER = (
+        'set_colormode',
+        'set_format',
+        'set_aoi',
+        'set_pixelclock',
+        'set_fps',
+        'set_exposure_auto',
+        'set_exposure',
+        'set_gain_auto',
+        'set_gain',
+        'set_black_level',
+    )
+
     def __init__(
         self, 
         device_id: int = 0, 
@@ -24,10 +39,19 @@ class Camera:
         buffer_count: int
             Number of buffers to allocate.
         """
+        self.device_id = device_id
         self.h_cam = ueye.HIDS(device_id)
         self.buffer_count = buffer_count
+        self.config = {}
         self.img_buffers = []
         self.current_fps = None
+        self.last_error = ueye.IS_SUCCESS
+        self.exposure_range = None
+        self.current_exposure = None
+        self.current_gain = None
+        self.format_catalog = None
+        # A live camera never runs out of frames (see ReplayCamera)
+        self.exhausted = False
 
     def __enter__(self) -> None:
         """
@@ -43,13 +67,50 @@ class Camera:
         return self
 
     def __exit__(self, _type, value, traceback):
-        if self.h_cam is not None:
-            ret = ueye.is_ExitCamera(self.h_cam)
+        if self.h_cam is None:
+            return
+        ret = ueye.is_ExitCamera(self.h_cam)
         if ret == ueye.IS_SUCCESS:
             self.h_cam = None
         else:
             raise UEyeError(ret)
 
+    def apply_config(self) -> None:
+        """
+        Apply again every setting recorded by the setters, used after the
+        camera has been reinitialized.
+        """
+        config = dict(self.config)
+        for name in self.CONFIG_ORDER:
+            if name in config:
+                getattr(self, name)(*config[name])
+
+    def reconnect(self) -> None:
+        """
+        Close and reopen the camera, then apply the recorded settings.
+        Buffers are reallocated by the next capture_video.
+        Raises
+        ======
+        UEyeError
+        """
+        if self.h_cam is not None:
+            # The device may be gone, errors are expected here
+            ueye.is_StopLiveVideo(self.h_cam, ueye.IS_FORCE_VIDEO_STOP)
+            ueye.is_ExitImageQueue(self.h_cam)
+            for buff in self.img_buffers:
+                ueye.is_FreeImageMem(self.h_cam, buff.mem_ptr, buff.mem_id)
+            ueye.is_ExitCamera(self.h_cam)
+        self.img_buffers = []
+        self.current_fps = None
+        self.exposure_range = None
+        self.format_catalog = None
+        self.h_cam = ueye.HIDS(self.device_id)
+        ret = ueye.is_InitCamera(self.h_cam, None)
+        if ret != ueye.IS_SUCCESS:
+            self.h_cam = None
+            raise UEyeError(ret)
+        self.apply_config()
+
     @property
     def camera(self) -> ueye.HIDS:
         """
@@ -118,6 +179,43 @@ class Camera:
         rect_aoi.s32Height = ueye.int(height)
         ueye.is_AOI(self.h_cam, ueye.IS_AOI_IMAGE_SET_AOI, rect_aoi,
                            ueye.sizeof(rect_aoi))
+        self.config['set_aoi'] = (x, y, width, height)
+
+    def get_aoi_increments(self) -> List[int]:
+        """
+        Get the AOI position and size granularity of the sensor.
+        Returns
+        =======
+        increments: list
+            [x_inc, y_inc, width_inc, height_inc]
+        """
+        pos_inc = ueye.IS_POINT_2D()
+        ret = ueye.is_AOI(self.h_cam, ueye.IS_AOI_IMAGE_GET_POS_INC,
+                          pos_inc, ueye.sizeof(pos_inc))
+        if ret != ueye.IS_SUCCESS:
+            raise UEyeError(ret)
+        size_inc = ueye.IS_SIZE_2D()
+        ret = ueye.is_AOI(self.h_cam, ueye.IS_AOI_IMAGE_GET_SIZE_INC,
+                          size_inc, ueye.sizeof(size_inc))
+        if ret != ueye.IS_SUCCESS:
+            raise UEyeError(ret)
+        return [pos_inc.s32X.value, pos_inc.s32Y.value,
+                size_inc.s32Width.value, size_inc.s32Height.value]
+
+    def get_sensor_size(self) -> List[int]:
+        """
+        Get the maximal image size of the sensor.
+        Returns
+        =======
+        size: list
+            [width, height]
+        """
+        size_max = ueye.IS_SIZE_2D()
+        ret = ueye.is_AOI(self.h_cam, ueye.IS_AOI_IMAGE_GET_SIZE_MAX,
+                          size_max, ueye.sizeof(size_max))
+        if ret != ueye.IS_SUCCESS:
+            raise UEyeError(ret)
+        return [size_max.s32Width.value, size_max.s32Height.value]
 
     def set_fps(self, fps):
         """
@@ -145,6 +243,9 @@ class Camera:
         if ret != ueye.IS_SUCCESS:
             raise UEyeError(ret)
         self.current_fps = float(new_fps)
+        self.config['set_fps'] = (self.current_fps,)
+        # The exposure range depends on the frame rate
+        self.exposure_range = None
 
     def get_fps(self) -> float:
         """
@@ -152,7 +253,7 @@ class Camera:
         Returns
         =======
         fps: number
-            Current fps.
+            Current fps, the configured one when not capturing.
         """
         if self.current_fps is not None:
             return self.current_fps
@@ -160,6 +261,13 @@ class Camera:
         ret = ueye.is_GetFramesPerSecond(self.h_cam, fps)
         if ret != ueye.IS_SUCCESS:
             raise UEyeError(ret)
+        if fps.value == 0:
+            # No frame is measured outside of a capture
+            ret = ueye.is_SetFrameRate(self.h_cam,
+                                       ueye.c_double(ueye.IS_GET_FRAMERATE),
+                                       fps)
+            if ret != ueye.IS_SUCCESS:
+                raise UEyeError(ret)
         return fps
 
     def get_fps_range(self) -> List[float]:
@@ -190,14 +298,7 @@ class Camera:
         pixelclock: number
             Current pixelclock.
         """
-        # get pixelclock range
-        pcrange = (ueye.c_uint*3)()
-        ret = ueye.is_PixelClock(self.h_cam, ueye.IS_PIXELCLOCK_CMD_GET_RANGE,
-                                 pcrange, 12)
-        if ret != ueye.IS_SUCCESS:
-            raise UEyeError(ret)
-
-        pcmin, pcmax, pcincr = pcrange
+        pcmin, pcmax, pcincr = self.get_pixelclock_range()
         if pixelclock < pcmin:
             pixelclock = pcmin
             print(f"Pixelclock out of range [{pcmin}, {pcmax}] and set "
@@ -212,6 +313,23 @@ class Camera:
                                  pixelclock, 4)
         if ret != ueye.IS_SUCCESS:
             raise UEyeError(ret)
+        self.config['set_pixelclock'] = (pixelclock.value,)
+        self.exposure_range = None
+
+    def get_pixelclock_range(self) -> List[int]:
+        """
+        Get the available pixelclock range.
+        Returns
+        =======
+        pixelclock_range: 3x1 array
+            [minimum, maximum, increment] pixelclock, in MHz.
+        """
+        pcrange = (ueye.c_uint*3)()
+        ret = ueye.is_PixelClock(self.h_cam, ueye.IS_PIXELCLOCK_CMD_GET_RANGE,
+                                 pcrange, 12)
+        if ret != ueye.IS_SUCCESS:
+            raise UEyeError(ret)
+        return [int(v) for v in pcrange]
 
     def get_pixelclock(self) -> int:
         """
@@ -242,6 +360,9 @@ class Camera:
                                new_exposure, 8)
         if ret != ueye.IS_SUCCESS:
             raise UEyeError(ret)
+        # The driver writes back the exposure actually set
+        self.current_exposure = float(new_exposure)
+        self.config['set_exposure'] = (self.current_exposure,)
 
     def get_exposure(self) -> float:
         """
@@ -259,6 +380,26 @@ class Camera:
 
         return exposure
 
+    def get_exposure_range(self) -> List[float]:
+        """
+        Get the available exposure range, cached until the fps or the
+        pixelclock changes.
+        Returns
+        =======
+        exposure_range: 3x1 array
+            [minimum, maximum, increment] exposure, in ms.
+        """
+        if self.exposure_range is not None:
+            return self.exposure_range
+        exposure_range = (ueye.c_double*3)()
+        ret = ueye.is_Exposure(self.h_cam,
+                               ueye.IS_EXPOSURE_CMD_GET_EXPOSURE_RANGE,
+                               exposure_range, 24)
+        if ret != ueye.IS_SUCCESS:
+            raise UEyeError(ret)
+        self.exposure_range = [float(v) for v in exposure_range]
+        return self.exposure_range
+
     def set_exposure_auto(self, toggle):
         """
         Set auto expose to on/off.
@@ -275,6 +416,7 @@ class Camera:
                                        value_to_return)
         if ret != ueye.IS_SUCCESS:
             raise UEyeError(ret)
+        self.config['set_exposure_auto'] = (toggle,)
 
     def set_gain(
             self, 
@@ -303,6 +445,22 @@ class Camera:
         )
         if ret != ueye.IS_SUCCESS:
             raise UEyeError(ret)
+        self.current_gain = master
+        self.config['set_gain'] = (master, red, green, blue)
+
+    def get_gain(self) -> int:
+        """
+        Get the current master gain.
+        Returns
+        =======
+        gain: int
+            Master gain, from 0 to 100.
+        """
+        return ueye.is_SetHardwareGain(self.h_cam,
+                                       ueye.IS_GET_MASTER_GAIN,
+                                       ueye.IS_IGNORE_PARAMETER,
+                                       ueye.IS_IGNORE_PARAMETER,
+                                       ueye.IS_IGNORE_PARAMETER)
 
     def set_black_level(self, black_level: int) -> None:
         """
@@ -318,6 +476,7 @@ class Camera:
                                  new_black_level, 4)
         if ret != ueye.IS_SUCCESS:
             raise UEyeError(ret)
+        self.config['set_black_level'] = (black_level,)
 
     def set_gain_auto(self, toggle):
         """
@@ -335,6 +494,7 @@ class Camera:
                                        value_to_return)
         if ret != ueye.IS_SUCCESS:
             raise UEyeError(ret)
+        self.config['set_gain_auto'] = (toggle,)
 
     def __get_timeout(self):
         fps = self.get_fps()
@@ -360,17 +520,55 @@ class Camera:
         """
         return ueye.is_StopLiveVideo(self.h_cam, ueye.IS_FORCE_VIDEO_STOP)
 
-    def capture_image(self, timeout=None):
+    def wait_for_next_image(
+            self,
+            timeout: Optional[int] = None
+    ) -> Optional[ImageData]:
+        """
+        Wait for the next frame of the running capture.
+        Parameters
+        ==========
+        timeout: int
+            Timeout in ms, default to 1.5 frame period.
+        Returns
+        =======
+        imdata: ImageData
+            Locked frame, to unlock once processed, or None if no frame
+            was received. The error code is then kept in last_error.
+        """
         if timeout is None:
             timeout = self.__get_timeout()
-        self.capture_video()
         img_buffer = ImageBuffer()
-        ret = ueye.is_WaitForNextImage(self.camera,
-                                       timeout,
-                                       img_buffer.mem_ptr,
-                                       img_buffer.mem_id)
-        if ret == ueye.IS_SUCCESS:
-            imdata = ImageData(self.camera, img_buffer)
+        with metrics.time('wait'):
+            ret = ueye.is_WaitForNextImage(self.camera,
+                                           timeout,
+                                           img_buffer.mem_ptr,
+                                           img_buffer.mem_id)
+        self.last_error = ret
+        if ret != ueye.IS_SUCCESS:
+            metrics.inc('frames_dropped')
+            return None
+        metrics.inc('frames_captured')
+        return ImageData(self.camera, img_buffer)
+
+    def reset_capture_status(self) -> None:
+        """
+        Clear the capture error counters, after is_WaitForNextImage
+        returned IS_CAPTURE_STATUS.
+        Raises
+        ======
+        UEyeError
+        """
+        ret = ueye.is_CaptureStatus(self.camera,
+                                    ueye.IS_CAPTURE_STATUS_INFO_CMD_RESET,
+                                    None, 0)
+        if ret != ueye.IS_SUCCESS:
+            raise UEyeError(ret)
+
+    def capture_image(self, timeout=None):
+        self.capture_video()
+        imdata = self.wait_for_next_image(timeout)
+        if imdata is not None:
             data = imdata.as_np_image()
             imdata.unlock()
             self.stop_video()
@@ -384,13 +582,8 @@ class Camera:
         self.capture_video()
         ims = []
         for i in range(nmb):
-            img_buffer = ImageBuffer()
-            ret = ueye.is_WaitForNextImage(self.camera,
-                                           timeout,
-                                           img_buffer.mem_ptr,
-                                           img_buffer.mem_id)
-            if ret == ueye.IS_SUCCESS:
-                imdata = ImageData(self.camera, img_buffer)
+            imdata = self.wait_for_next_image(timeout)
+            if imdata is not None:
                 ims.append(imdata.as_np_image())
                 imdata.unlock()
             else:
@@ -421,6 +614,7 @@ class Camera:
         ret = ueye.is_SetColorMode(self.h_cam, colormode)
         if ret != ueye.IS_SUCCESS:
             raise UEyeError(ret)
+        self.config['set_colormode'] = (colormode,)
 
     def get_colormode(self):
         """
@@ -431,6 +625,11 @@ class Camera:
 
     def get_format_list(self):
         """
+        Get the image formats supported by the sensor.
+        See formats.get_format_catalog for a parsed, indexed version.
+        Returns
+        =======
+        format_list: ueye.IMAGE_FORMAT_LIST
         """
         count = ueye.UINT()
         ret = ueye.is_ImageFormat(self.h_cam, ueye.IMGFRMT_CMD_GET_NUM_ENTRIES,
@@ -446,4 +645,23 @@ class Camera:
                                   format_list, ueye.sizeof(format_list))
         if ret != ueye.IS_SUCCESS:
             raise UEyeError(ret)
-        return format_list
\ No newline at end of file
+        return format_list
+
+    def set_format(self, format_id: int) -> None:
+        """
+        Set one of the sensor image formats (size, binning, subsampling).
+        Parameters
+        ==========
+        format_id: int
+            nFormatID of an entry of get_format_list.
+        """
+        value = ueye.c_uint(format_id)
+        ret = ueye.is_ImageFormat(self.h_cam, ueye.IMGFRMT_CMD_SET_FORMAT,
+                                  value, ueye.sizeof(value))
+        if ret != ueye.IS_SUCCESS:
+            raise UEyeError(ret)
+        self.config['set_format'] = (format_id,)
+        # The AOI is reset by the format, forget the previous one
+        self.config.pop('set_aoi', None)
+        self.current_fps = None
+        self.exposure_range = None
@@ -0,0 +1,443 @@
+import cv2
+import numpy as np
+from time import perf_counter
+from typing import List, Optional, Sequence
+from .metrics import metrics
+
+
+class Encoder:
+    """
+    Base class of the image encoders used by the writors.
+    """
+    extension = None
+
+    def encode(self, img: np.ndarray) -> np.ndarray:
+        """
+        Encode an image.
+        Returns
+        =======
+        data: 1d uint8 array
+            Encoded image, only valid until the next call.
+        """
+        raise NotImplementedError()
+
+    def decode(self, data) -> np.ndarray:
+        """
+        Decode an image produced by encode, used by the benchmark.
+        """
+        return cv2.imdecode(np.frombuffer(data, np.uint8),
+                            cv2.IMREAD_UNCHANGED)
+
+    def save(self, path: str, img: np.ndarray) -> bool:
+        """
+        Encode an image and write it to the disk.
+        Returns
+        =======
+        success: bool
+        """
+        with metrics.time('encode'):
+            try:
+                data = self.encode(img)
+            except (cv2.error, ValueError) as e:
+                print(f'Failed to encode image {path}: {e}')
+                return False
+        with metrics.time('write'):
+            with open(path, 'wb') as f:
+                f.write(data)
+        metrics.inc('frames_saved')
+        return True
+
+    def __repr__(self) -> str:
+        params = ', '.join(f'{k}={v!r}' for k, v in vars(self).items()
+                           if not k.startswith('_'))
+        return f'{type(self).__name__}({params})'
+
+
+class OpenCVEncoder(Encoder):
+    """
+    Encoder based on cv2.imencode, with explicit parameters.
+    """
+    def __init__(self, extension: str, params: Sequence[int] = ()) -> None:
+        """
+        Parameters
+        ==========
+        extension: str
+            File extension, it selects the format ('jpg', 'png', 'bmp'...).
+        params: list of int
+            cv2.IMWRITE_* flags and values.
+        """
+        self.extension = extension
+        self.params = list(params)
+
+    def encode(self, img: np.ndarray) -> np.ndarray:
+        ret, data = cv2.imencode('.' + self.extension, img, self.params)
+        if not ret:
+            raise ValueError(f'cv2.imencode failed for .{self.extension}')
+        return data
+
+
+class JpegEncoder(OpenCVEncoder):
+    """
+    JPEG encoder based on OpenCV.
+    """
+    SUBSAMPLING = {
+        '444': 'IMWRITE_JPEG_SAMPLING_FACTOR_444',
+        '422': 'IMWRITE_JPEG_SAMPLING_FACTOR_422',
+        '420': 'IMWRITE_JPEG_SAMPLING_FACTOR_420',
+        '411': 'IMWRITE_JPEG_SAMPLING_FACTOR_411',
+        '440': 'IMWRITE_JPEG_SAMPLING_FACTOR_440',
+    }
+
+    def __init__(
+            self,
+            quality: int = 95,
+            subsampling: Optional[str] = None,
+            optimize: bool = False,
+            progressive: bool = False,
+            restart_interval: int = 0
+    ) -> None:
+        """
+        Parameters
+        ==========
+        quality: int
+            JPEG quality, from 0 to 100.
+        subsampling: str
+            Chroma subsampling ('444', '422', '420', '411', '440'),
+            None keeps the OpenCV default. Requires OpenCV >= 4.5.5.
+        optimize: bool
+            Optimize the Huffman tables (smaller, slower).
+        progressive: bool
+            Write a progressive JPEG.
+        restart_interval: int
+            Number of MCU between restart markers, 0 to disable.
+        """
+        params = [cv2.IMWRITE_JPEG_QUALITY, int(quality),
+                  cv2.IMWRITE_JPEG_OPTIMIZE, int(optimize),
+                  cv2.IMWRITE_JPEG_PROGRESSIVE, int(progressive),
+                  cv2.IMWRITE_JPEG_RST_INTERVAL, int(restart_interval)]
+        if subsampling is not None:
+            if subsampling not in self.SUBSAMPLING:
+                raise ValueError(f'Unknown subsampling: {subsampling}')
+            if not hasattr(cv2, 'IMWRITE_JPEG_SAMPLING_FACTOR'):
+                raise ValueError('Chroma subsampling requires '
+                                 'OpenCV >= 4.5.5')
+            params += [cv2.IMWRITE_JPEG_SAMPLING_FACTOR,
+                       getattr(cv2, self.SUBSAMPLING[subsampling])]
+        super().__init__('jpg', params)
+        self.quality = quality
+        self.subsampling = subsampling
+        self.optimize = optimize
+        self.progressive = progressive
+        self.restart_interval = restart_interval
+
+
+class PngEncoder(OpenCVEncoder):
+    """
+    PNG encoder based on OpenCV.
+    """
+    STRATEGIES = {
+        'default': 'IMWRITE_PNG_STRATEGY_DEFAULT',
+        'filtered': 'IMWRITE_PNG_STRATEGY_FILTERED',
+        'huffman': 'IMWRITE_PNG_STRATEGY_HUFFMAN_ONLY',
+        'rle': 'IMWRITE_PNG_STRATEGY_RLE',
+        'fixed': 'IMWRITE_PNG_STRATEGY_FIXED',
+    }
+
+    def __init__(
+            self,
+            compression: int = 1,
+            strategy: str = 'default'
+    ) -> None:
+        """
+        Parameters
+        ==========
+        compression: int
+            zlib compression level, from 0 (fastest) to 9 (smallest).
+        strategy: str
+            zlib strategy ('default', 'filtered', 'huffman', 'rle',
+            'fixed'), 'rle' and 'huffman' are the fastest.
+        """
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f'Unknown PNG strategy: {strategy}')
+        params = [cv2.IMWRITE_PNG_COMPRESSION, int(compression),
+                  cv2.IMWRITE_PNG_STRATEGY,
+                  getattr(cv2, self.STRATEGIES[strategy])]
+        super().__init__('png', params)
+        self.compression = compression
+        self.strategy = strategy
+
+
+class TurboJpegEncoder(Encoder):
+    """
+    JPEG encoder based on libjpeg-turbo, requires PyTurboJPEG.
+    """
+    extension = 'jpg'
+
+    def __init__(
+            self,
+            quality: int = 95,
+            subsampling: str = '420',
+            fast_dct: bool = True,
+            lib_path: Optional[str] = None
+    ) -> None:
+        """
+        Parameters
+        ==========
+        quality: int
+            JPEG quality, from 0 to 100.
+        subsampling: str
+            Chroma subsampling ('444', '422', '420', '411', '440').
+        fast_dct: bool
+            Use the fast, slightly less accurate, DCT.
+        lib_path: str
+            Path to libturbojpeg, None to let PyTurboJPEG find it.
+        """
+        try:
+            import turbojpeg
+        except ImportError:
+            raise ImportError('TurboJpegEncoder requires PyTurboJPEG: '
+                              'pip install PyTurboJPEG')
+        samplings = {
+            '444': turbojpeg.TJSAMP_444,
+            '422': turbojpeg.TJSAMP_422,
+            '420': turbojpeg.TJSAMP_420,
+            '411': turbojpeg.TJSAMP_411,
+            '440': turbojpeg.TJSAMP_440,
+        }
+        if subsampling not in samplings:
+            raise ValueError(f'Unknown subsampling: {subsampling}')
+        self.quality = quality
+        self.subsampling = subsampling
+        self.fast_dct = fast_dct
+        self._tj = turbojpeg
+        self._jpeg = turbojpeg.TurboJPEG(lib_path)
+        self._sampling = samplings[subsampling]
+        self._flags = turbojpeg.TJFLAG_FASTDCT if fast_dct else 0
+
+    def encode(self, img: np.ndarray) -> bytes:
+        if img.ndim == 2:
+            pixel_format = self._tj.TJPF_GRAY
+            sampling = self._tj.TJSAMP_GRAY
+        elif img.shape[2] == 4:
+            pixel_format = self._tj.TJPF_BGRA
+            sampling = self._sampling
+        else:
+            pixel_format = self._tj.TJPF_BGR
+            sampling = self._sampling
+        return self._jpeg.encode(img, self.quality, pixel_format,
+                                 sampling, self._flags)
+
+    def decode(self, data) -> np.ndarray:
+        sampling = self._jpeg.decode_header(data)[2]
+        if sampling == self._tj.TJSAMP_GRAY:
+            img = self._jpeg.decode(data, pixel_format=self._tj.TJPF_GRAY)
+            return img.reshape(img.shape[:2])
+        return self._jpeg.decode(data)
+
+
+class QoiEncoder(Encoder):
+    """
+    Fast lossless encoder using the QOI format, requires the qoi package.
+    """
+    extension = 'qoi'
+
+    def __init__(self) -> None:
+        try:
+            import qoi
+        except ImportError:
+            raise ImportError('QoiEncoder requires qoi: pip install qoi')
+        self._qoi = qoi
+        # QOI stores RGB(A), the conversion buffer is reused between frames
+        self._rgb = None
+
+    def encode(self, img: np.ndarray) -> bytes:
+        if img.ndim == 2:
+            code = cv2.COLOR_GRAY2RGB
+            shape = img.shape + (3,)
+        elif img.shape[2] == 4:
+            code = cv2.COLOR_BGRA2RGBA
+            shape = img.shape
+        else:
+            code = cv2.COLOR_BGR2RGB
+            shape = img.shape
+        if self._rgb is None or self._rgb.shape != shape:
+            self._rgb = np.empty(shape, np.uint8)
+        cv2.cvtColor(img, code, dst=self._rgb)
+        return self._qoi.encode(self._rgb)
+
+    def decode(self, data) -> np.ndarray:
+        img = self._qoi.decode(bytes(data))
+        if img.shape[2] == 4:
+            return cv2.cvtColor(img, cv2.COLOR_RGBA2BGRA)
+        return cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+
+
+def get_encoder(save_format: str, **kwargs) -> Encoder:
+    """
+    Return the default encoder for a file format.
+    Parameters
+    ==========
+    save_format: str
+        File extension ('jpg', 'png', 'qoi', 'bmp'...).
+    kwargs:
+        Parameters of the encoder.
+    """
+    save_format = save_format.lower().lstrip('.')
+    if save_format in ('jpg', 'jpeg'):
+        return JpegEncoder(**kwargs)
+    if save_format == 'png':
+        return PngEncoder(**kwargs)
+    if save_format == 'qoi':
+        return QoiEncoder(**kwargs)
+    return OpenCVEncoder(save_format, **kwargs)
+
+
+def default_encoders() -> List[Encoder]:
+    """
+    Return the candidate encoders available on this host.
+    """
+    encoders = [
+        JpegEncoder(quality=95),
+        JpegEncoder(quality=90, subsampling='420')
+        if hasattr(cv2, 'IMWRITE_JPEG_SAMPLING_FACTOR')
+        else JpegEncoder(quality=90),
+        JpegEncoder(quality=80),
+        PngEncoder(compression=1, strategy='rle'),
+        PngEncoder(compression=3),
+    ]
+    for factory in (lambda: TurboJpegEncoder(quality=95),
+                    lambda: TurboJpegEncoder(quality=90),
+                    lambda: TurboJpegEncoder(quality=80),
+                    QoiEncoder):
+        try:
+            encoders.append(factory())
+        except (ImportError, RuntimeError, OSError):
+            pass
+    return encoders
+
+
+def _match_layout(frame: np.ndarray, decoded: np.ndarray) -> np.ndarray:
+    """
+    Convert a frame to the channel layout of its decoded version (gray
+    frames come back as BGR from QOI, JPEG drops the alpha channel).
+    """
+    channels = 1 if decoded.ndim == 2 else decoded.shape[2]
+    frame_channels = 1 if frame.ndim == 2 else frame.shape[2]
+    if channels == frame_channels:
+        return frame.reshape(decoded.shape)
+    code = {
+        (3, 1): cv2.COLOR_BGR2GRAY,
+        (4, 1): cv2.COLOR_BGRA2GRAY,
+        (1, 3): cv2.COLOR_GRAY2BGR,
+        (4, 3): cv2.COLOR_BGRA2BGR,
+        (1, 4): cv2.COLOR_GRAY2BGRA,
+        (3, 4): cv2.COLOR_BGR2BGRA,
+    }[(frame_channels, channels)]
+    return cv2.cvtColor(frame, code).reshape(decoded.shape)
+
+
+def benchmark_encoders(
+        frames: Sequence[np.ndarray],
+        encoders: Optional[Sequence[Encoder]] = None,
+        repeat: int = 3
+) -> List[dict]:
+    """
+    Measure the speed, size and quality of encoders on sample frames.
+    Parameters
+    ==========
+    frames: list of np.ndarray
+        Sample frames, as returned by ImageData.as_np_image.
+    encoders: list of Encoder
+        Encoders to compare (default to default_encoders()).
+    repeat: int
+        Number of encodings of each frame, the best time is kept.
+    Returns
+    =======
+    results: list of dict
+        One dict per encoder with 'encoder', 'seconds' (mean per frame),
+        'fps', 'ratio' (mean encoded/raw size) and 'psnr' (mean, inf
+        when lossless).
+    """
+    if encoders is None:
+        encoders = default_encoders()
+    results = []
+    for encoder in encoders:
+        seconds = 0.0
+        ratio = 0.0
+        psnr = 0.0
+        for frame in frames:
+            best = None
+            for _ in range(repeat):
+                start = perf_counter()
+                data = encoder.encode(frame)
+                elapsed = perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            seconds += best
+            ratio += len(data) / frame.nbytes
+            decoded = encoder.decode(data)
+            reference = _match_layout(frame, decoded)
+            if np.array_equal(decoded, reference):
+                psnr += float('inf')
+            else:
+                psnr += cv2.PSNR(reference, decoded)
+        count = len(frames)
+        results.append({
+            'encoder': encoder,
+            'seconds': seconds / count,
+            'fps': count / seconds if seconds else float('inf'),
+            'ratio': ratio / count,
+            'psnr': psnr / count,
+        })
+    return results
+
+
+def select_encoder(
+        frames: Sequence[np.ndarray],
+        encoders: Optional[Sequence[Encoder]] = None,
+        min_psnr: float = 0.0,
+        max_ratio: float = 1.0,
+        repeat: int = 3
+) -> Encoder:
+    """
+    Return the fastest encoder meeting a quality and size target.
+    Parameters
+    ==========
+    frames: list of np.ndarray
+        Sample frames.
+    encoders: list of Encoder
+        Encoders to compare (default to default_encoders()).
+    min_psnr: float
+        Minimal mean PSNR in dB (inf for lossless only).
+    max_ratio: float
+        Maximal mean encoded/raw size ratio.
+    Raises
+    ======
+    ValueError
+        No encoder meets the target.
+    """
+    results = benchmark_encoders(frames, encoders, repeat)
+    valid = [r for r in results
+             if r['psnr'] >= min_psnr and r['ratio'] <= max_ratio]
+    if not valid:
+        raise ValueError(f'No encoder reaches psnr >= {min_psnr} dB with a '
+                         f'size ratio <= {max_ratio}')
+    return min(valid, key=lambda r: r['seconds'])['encoder']
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark the image encoders on sample frames.')
+    parser.add_argument('images', nargs='+', help='Sample images')
+    parser.add_argument('--min-psnr', type=float, default=0.0)
+    parser.add_argument('--max-ratio', type=float, default=1.0)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    frames = [cv2.imread(path, cv2.IMREAD_UNCHANGED) for path in args.images]
+    results = benchmark_encoders(frames, repeat=args.repeat)
+    for r in sorted(results, key=lambda r: r['seconds']):
+        ok = r['psnr'] >= args.min_psnr and r['ratio'] <= args.max_ratio
+        print(f"{'*' if ok else ' '} {r['fps']:8.1f} fps "
+              f"{r['ratio']:6.3f} ratio {r['psnr']:6.2f} dB  {r['encoder']}")
@@ -1,6 +1,29 @@
 from pyueye import ueye
 
 
+# Errors meaning the device or the transfer failed, reinitializing the
+# camera may fix them. Any other error code is considered fatal.
+TRANSIENT_ERRORS = frozenset((
+    ueye.IS_TIMED_OUT,
+    ueye.IS_TRANSFER_ERROR,
+    ueye.IS_CAPTURE_STATUS,
+    ueye.IS_IO_REQUEST_FAILED,
+    ueye.IS_INVALID_CAMERA_HANDLE,
+    ueye.IS_INVALID_MEMORY_POINTER,
+    ueye.IS_NO_ACTIVE_IMG_MEM,
+    ueye.IS_CANT_OPEN_DEVICE,
+    ueye.IS_ALL_DEVICES_BUSY,
+    ueye.IS_NO_SUCCESS,
+))
+
+
+def is_fatal_error(error_code) -> bool:
+    """
+    Return True if the error code is not in TRANSIENT_ERRORS.
+    """
+    return error_code not in TRANSIENT_ERRORS
+
+
 class UEyeError(Exception):
     """
     A class to handle errors from the ueye API.
@@ -23,9 +46,17 @@ class UEyeError(Exception):
             ueye.IS_CANT_OPEN_DEVICE: "Cannot open device",
             ueye.IS_ALL_DEVICES_BUSY: "All device busy",
             ueye.IS_DEVICE_ALREADY_PAIRED: "Device already in use",
-            ueye.IS_TRANSFER_ERROR: "Transfer error"
+            ueye.IS_TRANSFER_ERROR: "Transfer error",
+            ueye.IS_CAPTURE_STATUS: "Capture error (see is_CaptureStatus)"
         }
 
+    @property
+    def is_fatal(self) -> bool:
+        """
+        True if the error can not be fixed by reinitializing the camera.
+        """
+        return is_fatal_error(self.error_code)
+
     def __str__(self):
         if self.error_code in self.error_codes:
             return self.error_codes[self.error_code]
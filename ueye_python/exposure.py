@@ -0,0 +1,236 @@
+import numpy as np
+from pyueye import ueye
+from threading import Condition, Thread
+from time import monotonic, perf_counter
+from typing import Optional
+from .camera import Camera
+from .metrics import metrics
+from .rect import Rect
+
+
+def subsample_stat(
+        img: np.ndarray,
+        percentile: Optional[float] = None,
+        stride: int = 4,
+        roi: Optional[Rect] = None
+) -> float:
+    """
+    Return the mean or a percentile of the brightness of a frame,
+    computed on a strided subsample.
+    Parameters
+    ==========
+    img: np.ndarray
+        Frame, mono or color (channels are averaged).
+    percentile: float
+        Percentile from 0 to 100, None for the mean.
+    stride: int
+        Keep one pixel every stride in both directions.
+    roi: Rect
+        Region to measure, in frame coordinates.
+    """
+    if roi is not None:
+        rows, cols = roi.slices()
+        img = img[rows, cols]
+    sample = img[::stride, ::stride]
+    if sample.ndim == 3:
+        # Average the color channels, alpha is ignored
+        if sample.dtype == np.uint8:
+            sample = (sample[..., :3].sum(axis=2, dtype=np.uint16) // 3) \
+                .astype(np.uint8)
+        else:
+            sample = sample[..., :3].mean(axis=2, dtype=np.float32)
+    if percentile is None:
+        return float(sample.mean())
+    if sample.dtype == np.uint8:
+        hist = np.bincount(sample.ravel(), minlength=256)
+        cumul = np.cumsum(hist)
+        rank = percentile / 100 * (cumul[-1] - 1)
+        return float(np.searchsorted(cumul, rank, side='right'))
+    return float(np.percentile(sample, percentile))
+
+
+class ExposureController(Thread):
+    """
+    Software auto exposure/gain running alongside the acquisition.
+    Frames are offered by the acquisition thread, every Nth one is
+    measured on a worker thread, and the exposure (then the gain, once the
+    exposure is at its maximum) is corrected by a rate limited
+    proportional loop.
+    """
+    def __init__(
+            self,
+            camera: Camera,
+            target: float = 118,
+            percentile: Optional[float] = None,
+            every: int = 5,
+            stride: int = 8,
+            roi: Optional[Rect] = None,
+            tolerance: float = 8,
+            damping: float = 0.7,
+            max_step: float = 2.0,
+            min_interval: float = 0.1,
+            use_gain: bool = True,
+            gain_step: int = 5,
+            max_gain: int = 100
+    ) -> None:
+        """
+        Parameters
+        ==========
+        camera: Camera
+            Camera to control.
+        target: float
+            Wanted brightness, in pixel values.
+        percentile: float
+            Percentile to bring to the target, None for the mean.
+        every: int
+            Measure every Nth offered frame.
+        stride: int
+            Subsampling step of the measure.
+        roi: Rect
+            Region to measure, in frame coordinates (whole frame if None).
+        tolerance: float
+            Brightness error considered as converged.
+        damping: float
+            Exponent applied to the correction ratio, < 1 for a smoother
+            convergence.
+        max_step: float
+            Maximal exposure ratio applied by one update.
+        min_interval: float
+            Minimal delay between two updates, in seconds.
+        use_gain: bool
+            Use the gain when the exposure range is exhausted.
+        gain_step: int
+            Master gain change applied by one update.
+        max_gain: int
+            Maximal master gain.
+        """
+        super().__init__(daemon=True)
+        self.cam = camera
+        self.target = target
+        self.percentile = percentile
+        self.every = max(1, int(every))
+        self.stride = stride
+        self.roi = roi
+        self.tolerance = tolerance
+        self.damping = damping
+        self.max_step = max_step
+        self.min_interval = min_interval
+        self.use_gain = use_gain
+        self.gain_step = gain_step
+        self.max_gain = max_gain
+
+        self.running = True
+        self.nmb_offered = 0
+        self.nmb_measured = 0
+        self.nmb_updates = 0
+        self.last_value = None
+        self.last_cost = 0.0
+        self.converged = False
+        self.convergence_time = None
+        # Set on the first measure, so the startup delay is not counted
+        self._unconverged_since = None
+        self._last_update = 0.0
+        self._exposure = None
+        self._gain = None
+        self._pending = None
+        self._cond = Condition()
+
+    def offer(self, img: np.ndarray) -> None:
+        """
+        Offer a frame, called by the acquisition thread.
+        """
+        self.nmb_offered += 1
+        if self.nmb_offered % self.every:
+            return
+        with self._cond:
+            self._pending = img
+            self._cond.notify()
+
+    def run(self) -> None:
+        self._exposure = float(self.cam.get_exposure())
+        self._gain = int(self.cam.get_gain())
+        while True:
+            with self._cond:
+                while self._pending is None and self.running:
+                    self._cond.wait()
+                if not self.running:
+                    break
+                img = self._pending
+                self._pending = None
+            self.update(img)
+
+    def measure(self, img: np.ndarray) -> float:
+        """
+        Return the brightness of a frame, as used by the loop.
+        """
+        start = perf_counter()
+        value = subsample_stat(img, self.percentile, self.stride, self.roi)
+        self.last_cost = perf_counter() - start
+        metrics.observe('exposure_measure', self.last_cost)
+        return value
+
+    def update(self, img: np.ndarray) -> None:
+        """
+        Measure a frame and correct the exposure/gain if needed.
+        """
+        value = self.measure(img)
+        self.last_value = value
+        self.nmb_measured += 1
+        now = monotonic()
+        if self._unconverged_since is None:
+            self._unconverged_since = now
+        error = value - self.target
+        if abs(error) <= self.tolerance:
+            if not self.converged:
+                self.converged = True
+                self.convergence_time = now - self._unconverged_since
+                metrics.set_gauge('exposure_convergence_seconds',
+                                  self.convergence_time)
+            return
+        if self.converged:
+            self.converged = False
+            self._unconverged_since = now
+        if now - self._last_update < self.min_interval:
+            return
+
+        ratio = (self.target / max(value, 1.0)) ** self.damping
+        ratio = min(max(ratio, 1 / self.max_step), self.max_step)
+        mini, maxi, _ = self.cam.get_exposure_range()
+        exposure = self._exposure
+        gain = self._gain
+        if ratio < 1 and gain > 0 and self.use_gain:
+            # Too bright, remove the gain before shortening the exposure
+            gain = max(0, gain - self.gain_step)
+        elif ratio > 1 and exposure >= maxi and self.use_gain:
+            gain = min(self.max_gain, gain + self.gain_step)
+        else:
+            exposure = min(max(exposure * ratio, mini), maxi)
+
+        if gain != self._gain:
+            self.set_master_gain(gain)
+            self._gain = gain
+        elif exposure != self._exposure:
+            self.cam.set_exposure(exposure)
+            self._exposure = exposure
+        else:
+            return
+        self._last_update = now
+        self.nmb_updates += 1
+        metrics.inc('exposure_updates')
+        metrics.set_gauge('exposure_ms', self._exposure)
+        metrics.set_gauge('gain', self._gain)
+
+    def set_master_gain(self, gain: int) -> None:
+        """
+        Set the master gain, keeping the color channel (white balance)
+        gains.
+        """
+        ignore = ueye.IS_IGNORE_PARAMETER
+        _, red, green, blue = self.cam.config.get(
+            'set_gain', (None, ignore, ignore, ignore))
+        self.cam.set_gain(gain, red, green, blue)
+
+    def stop(self) -> None:
+        with self._cond:
+            self.running = False
+            self._cond.notify()
@@ -0,0 +1,352 @@
+from pyueye import ueye
+from typing import List, Optional, Tuple
+from .camera import Camera
+from .exceptions import UEyeError
+from .rect import Rect
+from .roi import align_rect
+from .utils import get_bits_per_pixel
+
+
+# Color modes used for a requested color depth, in bits per pixel
+COLOR_MODES = {
+    8: ueye.IS_CM_MONO8,
+    24: ueye.IS_CM_BGR8_PACKED,
+    32: ueye.IS_CM_BGRA8_PACKED,
+}
+
+
+class ImageFormat:
+    """
+    A parsed entry of the sensor image format list.
+    """
+    def __init__(
+            self,
+            format_id: int,
+            name: str,
+            width: int,
+            height: int,
+            x: int = 0,
+            y: int = 0,
+            binning: int = 0,
+            subsampling: int = 0,
+            scaler_factor: float = 1.0,
+            capture_modes: int = 0
+    ) -> None:
+        self.format_id = format_id
+        self.name = name
+        self.width = width
+        self.height = height
+        self.x = x
+        self.y = y
+        self.binning = binning
+        self.subsampling = subsampling
+        self.scaler_factor = scaler_factor
+        self.capture_modes = capture_modes
+        # Filled by FormatCatalog.probe
+        self.max_fps = None
+        self.pixelclock_range = None
+
+    @property
+    def resolution(self) -> Tuple[int, int]:
+        return (self.width, self.height)
+
+    @property
+    def max_pixelclock(self) -> Optional[int]:
+        if self.pixelclock_range is None:
+            return None
+        return self.pixelclock_range[1]
+
+    def pixelclock_for(self, fps: float) -> int:
+        """
+        Return the lowest valid pixelclock reaching fps with the full
+        format, the readout time being inversely proportional to it.
+        """
+        pcmin, pcmax, pcinc = self.pixelclock_range
+        needed = pcmax * fps / self.max_fps
+        if pcinc > 0:
+            steps = -(-(needed - pcmin) // pcinc)
+            needed = pcmin + max(0, steps) * pcinc
+        return int(min(max(needed, pcmin), pcmax))
+
+    def __repr__(self) -> str:
+        fps = 'unknown' if self.max_fps is None else f'{self.max_fps:.1f}'
+        return (f'ImageFormat({self.format_id}, {self.name!r}, '
+                f'{self.width}x{self.height}, binning={self.binning}, '
+                f'subsampling={self.subsampling}, max_fps={fps})')
+
+
+class FormatCatalog:
+    """
+    The image formats of a camera, indexed by resolution, by
+    binning/subsampling mode and sorted by maximal fps once probed.
+    """
+    def __init__(self, formats: List[ImageFormat]) -> None:
+        self.formats = formats
+        self.by_id = {f.format_id: f for f in formats}
+        self.by_resolution = {}
+        self.by_mode = {}
+        for f in formats:
+            self.by_resolution.setdefault(f.resolution, []).append(f)
+            self.by_mode.setdefault((f.binning, f.subsampling), []).append(f)
+
+    @classmethod
+    def from_camera(cls, camera: Camera) -> 'FormatCatalog':
+        """
+        Parse the format list of a camera.
+        """
+        format_list = camera.get_format_list()
+        formats = []
+        for i in range(format_list.nNumListElements.value):
+            info = format_list.FormatInfo[i]
+            formats.append(ImageFormat(
+                format_id=info.nFormatID.value,
+                name=bytes(info.strFormatName).split(b'\0')[0].decode(
+                    errors='replace'),
+                width=info.nWidth.value,
+                height=info.nHeight.value,
+                x=info.nX0.value,
+                y=info.nY0.value,
+                binning=info.nBinningMode.value,
+                subsampling=info.nSubsamplingMode.value,
+                scaler_factor=info.dSensorScalerFactor.value,
+                capture_modes=info.nSupportedCaptureModes.value
+            ))
+        return cls(formats)
+
+    def probe(self, camera: Camera) -> None:
+        """
+        Measure the maximal fps of every format, at the maximal
+        pixelclock. The camera must not be capturing, its format, AOI,
+        pixelclock, fps and recorded configuration are restored afterwards.
+        Raises
+        ======
+        ValueError
+            The current format is unknown, so it could not be restored:
+            set it with Camera.set_format first.
+        """
+        config = dict(camera.config)
+        if 'set_format' in config:
+            format_id = config['set_format'][0]
+        else:
+            # The driver can not tell the current format, assume the
+            # default full sensor one
+            sensor = tuple(camera.get_sensor_size())
+            full = self.by_resolution.get(sensor)
+            if not full:
+                raise ValueError('Cannot tell the current image format, '
+                                 'set it with set_format before probing')
+            format_id = full[0].format_id
+        aoi = camera.get_aoi()
+        pixelclock = int(camera.get_pixelclock())
+        fps = float(camera.get_fps())
+        try:
+            for f in self.formats:
+                try:
+                    camera.set_format(f.format_id)
+                    f.pixelclock_range = camera.get_pixelclock_range()
+                    camera.set_pixelclock(f.max_pixelclock)
+                    f.max_fps = camera.get_fps_range()[1]
+                except UEyeError as e:
+                    print(f'Warning: cannot probe format {f.name}: {e}')
+        finally:
+            camera.set_format(format_id)
+            camera.set_aoi(aoi.x, aoi.y, aoi.width, aoi.height)
+            camera.set_pixelclock(pixelclock)
+            if fps > 0:
+                camera.set_fps(fps)
+            camera.config = config
+
+    @property
+    def probed(self) -> bool:
+        return any(f.max_fps is not None for f in self.formats)
+
+    def by_fps(self) -> List[ImageFormat]:
+        """
+        Return the probed formats, fastest first.
+        """
+        return sorted((f for f in self.formats if f.max_fps is not None),
+                      key=lambda f: f.max_fps, reverse=True)
+
+    def covering(self, width: int, height: int) -> List[ImageFormat]:
+        """
+        Return the formats at least as large as the given size.
+        """
+        return [f for f in self.formats
+                if f.width >= width and f.height >= height]
+
+
+def get_format_catalog(camera: Camera, probe: bool = False) -> FormatCatalog:
+    """
+    Return the format catalog of a camera, parsed once and cached on the
+    camera (cleared by Camera.reconnect).
+    Parameters
+    ==========
+    probe: bool
+        Measure the maximal fps of the formats if not done yet.
+    """
+    catalog = camera.format_catalog
+    if catalog is None:
+        catalog = camera.format_catalog = FormatCatalog.from_camera(camera)
+    if probe and not catalog.probed:
+        catalog.probe(camera)
+    return catalog
+
+
+class ModeSelection:
+    """
+    Camera settings chosen by select_mode, with the predicted throughput.
+    """
+    def __init__(
+            self,
+            image_format: ImageFormat,
+            aoi: Rect,
+            pixelclock: int,
+            colormode: int,
+            fps: float,
+            predicted_max_fps: float
+    ) -> None:
+        self.image_format = image_format
+        self.aoi = aoi
+        self.pixelclock = pixelclock
+        self.colormode = colormode
+        self.fps = fps
+        self.predicted_max_fps = predicted_max_fps
+
+    @property
+    def bytes_per_frame(self) -> int:
+        bpp = get_bits_per_pixel(self.colormode)
+        return self.aoi.width * self.aoi.height * bpp // 8
+
+    @property
+    def bandwidth(self) -> float:
+        """
+        Predicted bandwidth, in bytes per second.
+        """
+        return self.bytes_per_frame * self.fps
+
+    def report(self) -> str:
+        """
+        Return a description of the selection, without applying it.
+        """
+        f = self.image_format
+        return (f'Format:     {f.name} (id {f.format_id}, '
+                f'{f.width}x{f.height}, binning {f.binning}, '
+                f'subsampling {f.subsampling})\n'
+                f'AOI:        {self.aoi}\n'
+                f'Pixelclock: {self.pixelclock} MHz\n'
+                f'Color mode: {self.colormode} '
+                f'({get_bits_per_pixel(self.colormode)} bits)\n'
+                f'Frame rate: {self.fps:.2f} fps '
+                f'(predicted max {self.predicted_max_fps:.2f} fps)\n'
+                f'Bandwidth:  {self.bandwidth / 1e6:.1f} MB/s')
+
+    def apply(self, camera: Camera) -> float:
+        """
+        Apply the selection to a camera which is not capturing.
+        Returns
+        =======
+        fps: float
+            Frame rate actually set.
+        """
+        camera.set_colormode(self.colormode)
+        camera.set_format(self.image_format.format_id)
+        camera.set_aoi(self.aoi.x, self.aoi.y,
+                       self.aoi.width, self.aoi.height)
+        camera.set_pixelclock(self.pixelclock)
+        camera.set_fps(self.fps)
+        return camera.get_fps()
+
+
+def select_mode(
+        camera: Camera,
+        width: int,
+        height: int,
+        fps: Optional[float] = None,
+        color_depth: int = 8,
+        objective: str = 'fps',
+        apply: bool = False
+) -> ModeSelection:
+    """
+    Choose the sensor format, AOI, pixelclock and color mode for a target
+    resolution and frame rate.
+    Formats are probed once (see FormatCatalog.probe). The maximal fps of
+    a cropped AOI is predicted from the format one, assuming the readout
+    time is proportional to the number of rows.
+    Parameters
+    ==========
+    width, height: int
+        Wanted image size, the AOI is centered in the chosen format.
+    fps: float
+        Wanted frame rate, None for the maximum.
+    color_depth: int
+        Bits per pixel, 8 (mono), 24 (BGR) or 32 (BGRA).
+    objective: str
+        'fps' to maximize the reachable frame rate, 'bandwidth' to
+        minimize the transferred bytes per second (AOI size, color depth
+        and frame rate, binned/subsampled formats preferred, then the
+        lowest pixelclock reaching fps). Without fps, the bandwidth
+        objective picks the slowest format.
+    apply: bool
+        Apply the selection, False for a dry run (see report()).
+    Raises
+    ======
+    ValueError
+        No format reaches the target.
+    """
+    if color_depth not in COLOR_MODES:
+        raise ValueError(f'Unsupported color depth: {color_depth}')
+    if objective not in ('fps', 'bandwidth'):
+        raise ValueError(f'Unknown objective: {objective}')
+    catalog = get_format_catalog(camera, probe=True)
+    x_inc, y_inc, width_inc, height_inc = camera.get_aoi_increments()
+    colormode = COLOR_MODES[color_depth]
+    bytes_per_pixel = get_bits_per_pixel(colormode) / 8
+
+    candidates = []
+    for f in catalog.covering(width, height):
+        if f.max_fps is None:
+            continue
+        aoi = align_rect(Rect((f.width - width) // 2,
+                              (f.height - height) // 2,
+                              width, height),
+                         x_inc, y_inc, width_inc, height_inc,
+                         f.width, f.height)
+        predicted = f.max_fps * f.height / aoi.height
+        if fps is not None and predicted < fps:
+            continue
+        candidates.append((f, aoi, predicted))
+    if not candidates:
+        raise ValueError(f'No format reaches {width}x{height}'
+                         + ('' if fps is None else f' at {fps} fps'))
+
+    if objective == 'fps':
+        f, aoi, predicted = max(candidates, key=lambda c: c[2])
+        pixelclock = f.max_pixelclock
+    else:
+        def cost(candidate):
+            f, aoi, predicted = candidate
+            rate = predicted if fps is None else fps
+            transferred = aoi.width * aoi.height * bytes_per_pixel * rate
+            # At equal bandwidth, binned/subsampled formats read less data
+            # out of the sensor, then prefer the fastest format
+            reduced = bool(f.binning or f.subsampling)
+            return (transferred, not reduced, -predicted)
+
+        f, aoi, predicted = min(candidates, key=cost)
+        pixelclock = f.max_pixelclock
+        if fps is not None:
+            # Lowest pixelclock still reaching fps with the cropped AOI
+            pixelclock = f.pixelclock_for(fps * aoi.height / f.height)
+            predicted = predicted * pixelclock / f.max_pixelclock
+
+    selection = ModeSelection(
+        image_format=f,
+        aoi=aoi,
+        pixelclock=pixelclock,
+        colormode=colormode,
+        fps=predicted if fps is None else fps,
+        predicted_max_fps=predicted
+    )
+    if apply:
+        selection.apply(camera)
+    return selection
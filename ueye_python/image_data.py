@@ -1,8 +1,10 @@
 import numpy as np
+from time import time
 from pyueye import ueye
 from .utils import get_bits_per_pixel
 from .image_buffer import ImageBuffer
 from .exceptions import UEyeError
+from .metrics import metrics
 
 class MemoryInfo:
     """
@@ -38,15 +40,18 @@ class ImageData:
     def __init__(self, h_cam: ueye.HIDS, img_buff: ImageBuffer) -> None:
         self.h_cam = h_cam
         self.img_buff = img_buff
+        self.timestamp = time()
+        self._frame_number = None
         self.mem_info = MemoryInfo(h_cam, img_buff)
         self.color_mode = ueye.is_SetColorMode(h_cam, ueye.IS_GET_COLOR_MODE)
         self.bits_per_pixel = get_bits_per_pixel(self.color_mode)
-        self.array = ueye.get_data(self.img_buff.mem_ptr,
-                                   self.mem_info.width,
-                                   self.mem_info.height,
-                                   self.mem_info.bits,
-                                   self.mem_info.pitch,
-                                   True)
+        with metrics.time('copy'):
+            self.array = ueye.get_data(self.img_buff.mem_ptr,
+                                       self.mem_info.width,
+                                       self.mem_info.height,
+                                       self.mem_info.bits,
+                                       self.mem_info.pitch,
+                                       True)
 
     def as_np_image(self) -> np.ndarray:
         """
@@ -62,6 +67,28 @@ class ImageData:
             return np.reshape(self.array, (self.mem_info.height,
                                               self.mem_info.width))
 
+    def read_info(self) -> None:
+        """
+        Read the frame information from the camera, must be called before
+        the buffer is unlocked. The values are cached.
+        """
+        if self._frame_number is not None:
+            return
+        info = ueye.UEYEIMAGEINFO()
+        ret = ueye.is_GetImageInfo(self.h_cam, self.img_buff.mem_id,
+                                   info, ueye.sizeof(info))
+        if ret != ueye.IS_SUCCESS:
+            raise UEyeError(ret)
+        self._frame_number = int(info.u64FrameNumber.value)
+
+    @property
+    def frame_number(self) -> int:
+        """
+        Return the frame number given by the camera.
+        """
+        self.read_info()
+        return self._frame_number
+
     def unlock(self) -> None:
         """
         Unlock the image buffer.
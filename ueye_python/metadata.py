@@ -0,0 +1,277 @@
+import os
+import numpy as np
+from queue import Queue, Empty
+from threading import Thread
+from time import time
+from typing import Optional
+from .metrics import metrics
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+def frame_dtype(name_length: int = 256) -> np.dtype:
+    """
+    Return the record type of a MetadataLog, name_length being the
+    maximal number of characters of the frame names.
+    """
+    return np.dtype([
+        ('timestamp', 'f8'),
+        ('frame_number', 'i8'),
+        ('exposure', 'f4'),
+        ('gain', 'i4'),
+        ('emptiness', 'f4'),
+        ('name', f'U{name_length}'),
+    ])
+
+
+FRAME_DTYPE = frame_dtype()
+
+INDEX_FILE = 'index.txt'
+
+
+class MetadataLog:
+    """
+    Per-frame metadata sidecar.
+    Records are written in a preallocated structured array and flushed in
+    batches, on a background thread, to an append-only columnar store:
+    Parquet parts when pyarrow is available, NPY chunks otherwise. A
+    Parquet part is only readable once closed, so a new part is started
+    every batches_per_part batches, a crash loses at most one part.
+    append is not thread safe, a log is fed by one writor; close it once
+    the writor has stopped.
+    """
+    def __init__(
+            self,
+            path: str,
+            batch_size: int = 1024,
+            file_format: str = 'auto',
+            batches_per_part: int = 8,
+            name_length: int = 256
+    ) -> None:
+        """
+        Parameters
+        ==========
+        path: str
+            Directory of the log.
+        batch_size: int
+            Number of records per flushed chunk.
+        file_format: str
+            'parquet', 'npy' or 'auto' (parquet if pyarrow is installed).
+        batches_per_part: int
+            Number of batches written to a Parquet part before it is
+            closed.
+        name_length: int
+            Maximal number of characters of the frame names.
+        """
+        if file_format == 'auto':
+            file_format = 'parquet' if pq is not None else 'npy'
+        if file_format not in ('parquet', 'npy'):
+            raise ValueError(f'Unknown metadata format: {file_format}')
+        if file_format == 'parquet' and pq is None:
+            raise ImportError('The parquet format requires pyarrow: '
+                              'pip install pyarrow')
+        self.path = path
+        self.batch_size = batch_size
+        self.file_format = file_format
+        self.batches_per_part = max(1, int(batches_per_part))
+        self.name_length = name_length
+        self.dtype = frame_dtype(name_length)
+        self.count = 0
+        self.nmb_chunks = 0
+        self.nmb_records = 0
+        self._part_batches = 0
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        extension = '.parquet' if file_format == 'parquet' else '.npy'
+        self.nmb_chunks = len([f for f in os.listdir(self.path)
+                               if f.endswith(extension)])
+
+        self.buffer = np.zeros(batch_size, self.dtype)
+        self._free = Queue()
+        self._full = Queue()
+        self._writer = None
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def append(
+            self,
+            timestamp: Optional[float] = None,
+            frame_number: int = -1,
+            exposure: float = np.nan,
+            gain: int = -1,
+            emptiness: float = np.nan,
+            name: str = ''
+    ) -> None:
+        """
+        Add a record, only a row copy, the write is done in background.
+        Raises
+        ======
+        ValueError
+            The name is longer than name_length.
+        """
+        if len(name) > self.name_length:
+            raise ValueError(f'Frame name longer than {self.name_length} '
+                             f'characters: {name}')
+        self.buffer[self.count] = (
+            time() if timestamp is None else timestamp,
+            frame_number,
+            exposure,
+            gain,
+            emptiness,
+            name
+        )
+        self.count += 1
+        if self.count == self.batch_size:
+            self.flush()
+
+    def log_frame(
+            self,
+            camera,
+            imdata,
+            name: str = '',
+            emptiness: float = np.nan
+    ) -> None:
+        """
+        Add the record of a frame, camera settings are read from the
+        camera cache (no driver call).
+        """
+        exposure = getattr(camera, 'current_exposure', None)
+        gain = getattr(camera, 'current_gain', None)
+        self.append(
+            timestamp=imdata.timestamp,
+            frame_number=imdata.frame_number,
+            exposure=np.nan if exposure is None else exposure,
+            gain=-1 if gain is None else gain,
+            emptiness=emptiness,
+            name=name
+        )
+
+    def flush(self) -> None:
+        """
+        Hand the current records to the writing thread.
+        """
+        if not self.count:
+            return
+        self._full.put((self.buffer, self.count))
+        self.count = 0
+        try:
+            self.buffer = self._free.get_nowait()
+        except Empty:
+            self.buffer = np.zeros(self.batch_size, self.dtype)
+
+    def _run(self) -> None:
+        while True:
+            item = self._full.get()
+            if item is None:
+                break
+            buffer, count = item
+            with metrics.time('metadata_write'):
+                self._write(buffer[:count])
+            self.nmb_records += count
+            self._free.put(buffer)
+        if self._writer is not None:
+            self._writer.close()
+
+    def _write(self, records: np.ndarray) -> None:
+        if self.file_format == 'parquet':
+            table = pa.table({name: np.ascontiguousarray(records[name])
+                              for name in self.dtype.names})
+            if self._writer is None:
+                path = os.path.join(
+                    self.path, f'metadata_{self.nmb_chunks:06d}.parquet')
+                self._writer = pq.ParquetWriter(path, table.schema)
+                self.nmb_chunks += 1
+            self._writer.write_table(table)
+            self._part_batches += 1
+            if self._part_batches >= self.batches_per_part:
+                # Write the footer, the part becomes readable
+                self._writer.close()
+                self._writer = None
+                self._part_batches = 0
+            return
+        name = f'chunk_{self.nmb_chunks:06d}.npy'
+        np.save(os.path.join(self.path, name), records)
+        with open(os.path.join(self.path, INDEX_FILE), 'a') as f:
+            f.write(f'{name} {records["timestamp"].min()!r} '
+                    f'{records["timestamp"].max()!r} {len(records)}\n')
+        self.nmb_chunks += 1
+
+    def close(self) -> None:
+        """
+        Flush the pending records and wait for them to be written.
+        """
+        self.flush()
+        self._full.put(None)
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _type, value, traceback):
+        self.close()
+
+
+def load_metadata(
+        path: str,
+        start: Optional[float] = None,
+        end: Optional[float] = None
+) -> np.ndarray:
+    """
+    Load the records of a MetadataLog, without reading any image.
+    Parquet parts still being written (or left incomplete by a crash) are
+    skipped.
+    Parameters
+    ==========
+    path: str
+        Directory of the log.
+    start, end: float
+        Time range (unix timestamps, inclusive), None for no bound.
+    Returns
+    =======
+    records: np.ndarray
+        Structured array of frame_dtype, sorted by timestamp.
+    """
+    lower = -np.inf if start is None else start
+    upper = np.inf if end is None else end
+    parts = []
+    parquets = sorted(f for f in os.listdir(path) if f.endswith('.parquet'))
+    if parquets:
+        if pq is None:
+            raise ImportError('Reading parquet metadata requires pyarrow')
+        filters = [('timestamp', '>=', lower), ('timestamp', '<=', upper)]
+        for name in parquets:
+            try:
+                table = pq.read_table(os.path.join(path, name),
+                                      filters=filters)
+            except pa.ArrowInvalid:
+                print(f'Warning: skipping incomplete metadata part {name}')
+                continue
+            names = table.column('name').to_numpy()
+            length = max([len(n) for n in names], default=1)
+            records = np.zeros(table.num_rows, frame_dtype(max(1, length)))
+            for column in records.dtype.names:
+                records[column] = table.column(column).to_numpy()
+            parts.append(records)
+    index = os.path.join(path, INDEX_FILE)
+    if os.path.exists(index):
+        with open(index) as f:
+            for line in f:
+                name, tmin, tmax, _ = line.split()
+                if float(tmax) < lower or float(tmin) > upper:
+                    continue
+                records = np.load(os.path.join(path, name))
+                mask = (records['timestamp'] >= lower) & \
+                    (records['timestamp'] <= upper)
+                parts.append(records[mask])
+    if not parts:
+        return np.zeros(0, FRAME_DTYPE)
+    # Parts may have different name lengths
+    length = max(p.dtype['name'].itemsize // 4 for p in parts)
+    dtype = frame_dtype(length)
+    records = np.concatenate([p.astype(dtype) for p in parts])
+    return records[np.argsort(records['timestamp'], kind='stable')]
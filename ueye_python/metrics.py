@@ -0,0 +1,248 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import perf_counter
+from typing import Dict, Optional
+
+
+class _NullTimer:
+    """
+    Timer returned when metrics are disabled, does nothing.
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _type, value, traceback):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class StageTimer:
+    """
+    Context manager measuring the duration of one stage.
+    """
+    __slots__ = ('metrics', 'stage', 'start')
+
+    def __init__(self, metrics: 'Metrics', stage: str) -> None:
+        self.metrics = metrics
+        self.stage = stage
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, _type, value, traceback):
+        self.metrics.observe(self.stage, perf_counter() - self.start)
+        return False
+
+
+class StageStats:
+    """
+    Accumulated durations of one stage, in seconds.
+    """
+    __slots__ = ('count', 'total', 'max', 'last')
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'max': self.max,
+            'last': self.last,
+            'mean': self.total / self.count if self.count else 0.0,
+        }
+
+
+class Metrics:
+    """
+    Registry of counters, gauges and per-stage timers.
+    When disabled, every call returns immediately.
+    """
+    def __init__(self, prefix: str = 'ueye', enabled: bool = False) -> None:
+        """
+        Parameters
+        ==========
+        prefix: str
+            Prefix of the exported metric names.
+        enabled: bool
+            Collect metrics or not (default to False).
+        """
+        self.prefix = prefix
+        self.enabled = enabled
+        self.counters = {}
+        self.gauges = {}
+        self.stages = {}
+        self._lock = Lock()
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def reset(self) -> None:
+        """
+        Drop every collected value.
+        """
+        with self._lock:
+            self.counters = {}
+            self.gauges = {}
+            self.stages = {}
+
+    def inc(self, name: str, value: int = 1) -> None:
+        """
+        Increment a counter.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float) -> None:
+        """
+        Set a gauge to the given value.
+        """
+        if not self.enabled:
+            return
+        self.gauges[name] = value
+
+    def observe(self, stage: str, seconds: float) -> None:
+        """
+        Record the duration of one stage.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            stats = self.stages.get(stage)
+            if stats is None:
+                stats = self.stages[stage] = StageStats()
+            stats.count += 1
+            stats.total += seconds
+            stats.last = seconds
+            if seconds > stats.max:
+                stats.max = seconds
+
+    def time(self, stage: str):
+        """
+        Return a context manager timing the given stage.
+        Example
+        =======
+        with metrics.time('encode'):
+            ...
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return StageTimer(self, stage)
+
+    def snapshot(self) -> dict:
+        """
+        Return a copy of the collected metrics.
+        Returns
+        =======
+        snapshot: dict
+            {'counters': {...}, 'gauges': {...}, 'stages': {stage: stats}}
+        """
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+                'stages': {
+                    name: stats.as_dict()
+                    for name, stats in self.stages.items()
+                },
+            }
+
+    def to_prometheus(self) -> str:
+        """
+        Return the collected metrics in the Prometheus text format.
+        """
+        snap = self.snapshot()
+        lines = []
+        for name, value in sorted(snap['counters'].items()):
+            metric = f'{self.prefix}_{name}_total'
+            lines.append(f'# TYPE {metric} counter')
+            lines.append(f'{metric} {value}')
+        for name, value in sorted(snap['gauges'].items()):
+            metric = f'{self.prefix}_{name}'
+            lines.append(f'# TYPE {metric} gauge')
+            lines.append(f'{metric} {value}')
+        if snap['stages']:
+            metric = f'{self.prefix}_stage_seconds'
+            lines.append(f'# TYPE {metric} summary')
+            for stage, stats in sorted(snap['stages'].items()):
+                label = f'{{stage="{stage}"}}'
+                lines.append(f'{metric}_count{label} {stats["count"]}')
+                lines.append(f'{metric}_sum{label} {stats["sum"]:.9f}')
+            metric = f'{self.prefix}_stage_seconds_max'
+            lines.append(f'# TYPE {metric} gauge')
+            for stage, stats in sorted(snap['stages'].items()):
+                label = f'{{stage="{stage}"}}'
+                lines.append(f'{metric}{label} {stats["max"]:.9f}')
+        return '\n'.join(lines) + '\n'
+
+
+# Default registry used by the camera, the image data and the writors.
+metrics = Metrics()
+
+
+class MetricsServer(Thread):
+    """
+    Thread serving the metrics over HTTP in the Prometheus text format.
+    """
+    def __init__(
+            self,
+            registry: Optional[Metrics] = None,
+            host: str = '127.0.0.1',
+            port: int = 9101
+    ) -> None:
+        """
+        Parameters
+        ==========
+        registry: Metrics
+            Registry to export (default to the module registry).
+        host: str
+            Address to listen on (default to localhost only).
+        port: int
+            Port to listen on.
+        """
+        super().__init__(daemon=True)
+        self.registry = registry if registry is not None else metrics
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+
+    @property
+    def address(self):
+        return self.server.server_address
+
+    def run(self) -> None:
+        self.server.serve_forever()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,149 @@
+import cv2
+import numpy as np
+from threading import Condition, Thread
+from time import monotonic
+from typing import Callable, Optional, Tuple
+from .metrics import metrics
+
+
+class PreviewStream(Thread):
+    """
+    Worker producing a decimated, low resolution preview of a stream.
+    Frames are offered from the acquisition thread, only the latest one
+    is kept, so a slow preview skips frames instead of slowing down the
+    producer.
+    """
+    def __init__(
+            self,
+            every: int = 1,
+            max_fps: Optional[float] = None,
+            scale: float = 1.0,
+            size: Optional[Tuple[int, int]] = None,
+            method: str = 'area'
+    ) -> None:
+        """
+        Parameters
+        ==========
+        every: int
+            Keep every Nth offered frame.
+        max_fps: float
+            Maximal preview frame rate, None for no limit.
+        scale: float
+            Resize factor, ignored when size is given.
+        size: (width, height)
+            Preview size.
+        method: str
+            'area' for cv2.resize with INTER_AREA, 'stride' for a strided
+            view (no copy, scale is rounded to 1/k).
+        """
+        super().__init__(daemon=True)
+        if method not in ('area', 'stride'):
+            raise ValueError(f'Unknown resize method: {method}')
+        self.every = max(1, int(every))
+        self.min_period = 1.0 / max_fps if max_fps else 0.0
+        self.scale = scale
+        self.size = size
+        self.method = method
+        self.running = True
+        self.nmb_offered = 0
+        self.nmb_skipped = 0
+        self.nmb_produced = 0
+        self.frame = None
+        self.frame_idx = 0
+        self.callbacks = []
+        self._pending = None
+        self._last_time = None
+        self._cond = Condition()
+
+    def subscribe(self, callback: Callable[[np.ndarray], None]) -> None:
+        """
+        Call the given function with every preview frame, on the worker.
+        """
+        self.callbacks.append(callback)
+
+    def offer(self, img: np.ndarray) -> bool:
+        """
+        Offer a full resolution frame, called by the producer.
+        Returns
+        =======
+        accepted: bool
+            False if the frame was decimated out.
+        """
+        self.nmb_offered += 1
+        if self.nmb_offered % self.every:
+            return False
+        if self.min_period:
+            now = monotonic()
+            if (self._last_time is not None
+                    and now - self._last_time < self.min_period):
+                return False
+            self._last_time = now
+        with self._cond:
+            if self._pending is not None:
+                self.nmb_skipped += 1
+                metrics.inc('preview_frames_skipped')
+            self._pending = img
+            self._cond.notify_all()
+        return True
+
+    def resize(self, img: np.ndarray) -> np.ndarray:
+        """
+        Return the preview sized version of a frame.
+        """
+        height, width = img.shape[:2]
+        if self.size is not None:
+            new_width, new_height = self.size
+        else:
+            new_width = int(width * self.scale)
+            new_height = int(height * self.scale)
+        if (new_width, new_height) == (width, height):
+            return img
+        if self.method == 'stride':
+            step = max(1, int(round(width / max(1, new_width))))
+            return img[::step, ::step]
+        return cv2.resize(img, (new_width, new_height),
+                          interpolation=cv2.INTER_AREA)
+
+    def run(self) -> None:
+        while True:
+            with self._cond:
+                while self._pending is None and self.running:
+                    self._cond.wait()
+                if not self.running:
+                    break
+                img = self._pending
+                self._pending = None
+            with metrics.time('preview'):
+                preview = self.resize(img)
+            with self._cond:
+                self.frame = preview
+                self.frame_idx += 1
+                self._cond.notify_all()
+            self.nmb_produced += 1
+            for callback in self.callbacks:
+                callback(preview)
+
+    def wait_frame(
+            self,
+            last_idx: int = 0,
+            timeout: Optional[float] = None
+    ) -> Tuple[Optional[np.ndarray], int]:
+        """
+        Wait for a preview frame newer than last_idx.
+        Returns
+        =======
+        frame, idx: np.ndarray, int
+            Latest preview frame (None on timeout) and its index.
+        """
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self.frame_idx > last_idx or not self.running,
+                timeout)
+            if self.frame_idx <= last_idx:
+                return None, last_idx
+            return self.frame, self.frame_idx
+
+    def stop(self) -> None:
+        with self._cond:
+            self.running = False
+            self._cond.notify_all()
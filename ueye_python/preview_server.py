@@ -0,0 +1,156 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Condition, Thread
+from typing import Optional, Tuple
+import numpy as np
+from .encoder import Encoder, JpegEncoder
+from .metrics import metrics
+from .preview import PreviewStream
+
+
+class MjpegServer(Thread):
+    """
+    Thread serving a PreviewStream as MJPEG over HTTP
+    (multipart/x-mixed-replace).
+    Each preview frame is encoded once and shared by every client. Clients
+    always get the latest frame, a slow client skips frames instead of
+    queueing them. The resolution and fps caps are the ones of the
+    PreviewStream.
+    """
+    BOUNDARY = 'ueyeframe'
+
+    def __init__(
+            self,
+            preview: PreviewStream,
+            host: str = '127.0.0.1',
+            port: int = 8080,
+            encoder: Optional[Encoder] = None
+    ) -> None:
+        """
+        Parameters
+        ==========
+        preview: PreviewStream
+            Preview to serve, see DualStreamWritor.
+        host: str
+            Address to listen on (default to localhost only).
+        port: int
+            Port to listen on.
+        encoder: Encoder
+            JPEG encoder, default to JpegEncoder(quality=80).
+        """
+        super().__init__(daemon=True)
+        self.preview = preview
+        self.encoder = encoder if encoder is not None else \
+            JpegEncoder(quality=80)
+        self.running = True
+        self.nmb_clients = 0
+        self.jpeg = None
+        self.jpeg_idx = 0
+        self._cond = Condition()
+        self.preview.subscribe(self._on_frame)
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                if path in ('/', '/stream.mjpg'):
+                    server._stream(self)
+                elif path == '/snapshot.jpg':
+                    server._snapshot(self)
+                else:
+                    self.send_error(404)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self.server.server_address
+
+    def _on_frame(self, img: np.ndarray) -> None:
+        # Called on the preview worker, encode only when someone watches
+        if not self.nmb_clients:
+            return
+        with metrics.time('preview_encode'):
+            jpeg = bytes(self.encoder.encode(img))
+        with self._cond:
+            if not self.nmb_clients:
+                # The last client left while encoding
+                return
+            self.jpeg = jpeg
+            self.jpeg_idx += 1
+            self._cond.notify_all()
+
+    def _wait_jpeg(self, last_idx: int, timeout: float = 1.0):
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self.jpeg_idx > last_idx or not self.running,
+                timeout)
+            return self.jpeg, self.jpeg_idx
+
+    def _stream(self, handler: BaseHTTPRequestHandler) -> None:
+        handler.send_response(200)
+        handler.send_header('Cache-Control', 'no-cache, private')
+        handler.send_header('Pragma', 'no-cache')
+        handler.send_header(
+            'Content-Type',
+            f'multipart/x-mixed-replace; boundary={self.BOUNDARY}')
+        handler.end_headers()
+        with self._cond:
+            self.nmb_clients += 1
+            # Wait for a fresh frame, the last one may be old
+            last_idx = self.jpeg_idx
+        metrics.set_gauge('preview_clients', self.nmb_clients)
+        try:
+            while self.running:
+                jpeg, idx = self._wait_jpeg(last_idx)
+                if idx == last_idx:
+                    continue
+                last_idx = idx
+                handler.wfile.write(
+                    f'--{self.BOUNDARY}\r\n'
+                    f'Content-Type: image/jpeg\r\n'
+                    f'Content-Length: {len(jpeg)}\r\n\r\n'.encode())
+                handler.wfile.write(jpeg)
+                handler.wfile.write(b'\r\n')
+                metrics.inc('preview_frames_sent')
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with self._cond:
+                self.nmb_clients -= 1
+                if not self.nmb_clients:
+                    # Frames are no longer encoded, drop the last one
+                    self.jpeg = None
+            metrics.set_gauge('preview_clients', self.nmb_clients)
+
+    def _snapshot(self, handler: BaseHTTPRequestHandler) -> None:
+        jpeg = None
+        if self.nmb_clients:
+            # The stream keeps the latest frame encoded, share it
+            jpeg, _ = self._wait_jpeg(0)
+        if jpeg is None:
+            frame, _ = self.preview.wait_frame(timeout=1.0)
+            if frame is None:
+                handler.send_error(503, 'No frame available')
+                return
+            with metrics.time('preview_encode'):
+                jpeg = bytes(self.encoder.encode(frame))
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'image/jpeg')
+        handler.send_header('Content-Length', str(len(jpeg)))
+        handler.end_headers()
+        handler.wfile.write(jpeg)
+
+    def run(self) -> None:
+        self.server.serve_forever()
+
+    def stop(self) -> None:
+        with self._cond:
+            self.running = False
+            self._cond.notify_all()
+        self.server.shutdown()
+        self.server.server_close()
@@ -12,4 +12,45 @@ class Rect:
         self.x = x
         self.y = y
         self.width = width
-        self.height = height
\ No newline at end of file
+        self.height = height
+
+    def __repr__(self) -> str:
+        return f'Rect({self.x}, {self.y}, {self.width}, {self.height})'
+
+    @property
+    def right(self) -> int:
+        return self.x + self.width
+
+    @property
+    def bottom(self) -> int:
+        return self.y + self.height
+
+    def union(self, other: 'Rect') -> 'Rect':
+        """
+        Return the smallest rectangle containing both rectangles.
+        """
+        x = min(self.x, other.x)
+        y = min(self.y, other.y)
+        return Rect(x, y,
+                    max(self.right, other.right) - x,
+                    max(self.bottom, other.bottom) - y)
+
+    def contains(self, other: 'Rect') -> bool:
+        """
+        Return True if other is inside this rectangle.
+        """
+        return self.x <= other.x and self.y <= other.y and \
+            other.right <= self.right and other.bottom <= self.bottom
+
+    def offset(self, dx: int, dy: int) -> 'Rect':
+        """
+        Return the rectangle moved by (dx, dy).
+        """
+        return Rect(self.x + dx, self.y + dy, self.width, self.height)
+
+    def slices(self):
+        """
+        Return the (rows, columns) slices selecting the rectangle in an
+        image array.
+        """
+        return (slice(self.y, self.bottom), slice(self.x, self.right))
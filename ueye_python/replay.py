@@ -0,0 +1,350 @@
+import os
+import cv2
+import numpy as np
+from concurrent.futures import Future, ThreadPoolExecutor
+from pyueye import ueye
+from queue import Queue, Empty, Full
+from threading import Lock, Thread
+from time import monotonic, perf_counter, sleep
+from typing import List, Optional, Tuple
+from .exceptions import UEyeError
+from .metrics import metrics
+from .rect import Rect
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.qoi')
+
+
+class ReplayImageData:
+    """
+    Frame returned by ReplayCamera, mimics ImageData.
+    """
+    def __init__(self, img: np.ndarray, frame_idx: int,
+                 timestamp: float) -> None:
+        self.img = img
+        self.frame_idx = frame_idx
+        self.timestamp = timestamp
+
+    @property
+    def frame_number(self) -> int:
+        return self.frame_idx
+
+    def read_info(self) -> None:
+        pass
+
+    def as_np_image(self) -> np.ndarray:
+        return self.img
+
+    def unlock(self) -> None:
+        pass
+
+
+class ReplayCamera:
+    """
+    Virtual camera replaying frames recorded by ThreadWritor, CliWritor
+    (image directories) or VieoWritor (video file).
+    It exposes the frame acquisition interface of Camera, so the writors
+    can process recorded footage exactly like live frames.
+    """
+    MODES = ('original', 'fixed', 'fast')
+
+    def __init__(
+            self,
+            source: str,
+            mode: str = 'original',
+            fps: Optional[float] = None,
+            prefetch: int = 32,
+            workers: int = 2
+    ) -> None:
+        """
+        Parameters
+        ==========
+        source: str
+            Directory of images (searched recursively, ordered by
+            modification time) or video file.
+        mode: str
+            'original' to replay with the recorded timing (file
+            modification times or video timestamps), 'fixed' to replay
+            at fps, 'fast' to replay as fast as frames are decoded.
+        fps: float
+            Frame rate of the 'fixed' mode, default to the video fps.
+        prefetch: int
+            Maximal number of frames decoded in advance.
+        workers: int
+            Number of decoding threads for image directories.
+        """
+        if mode not in self.MODES:
+            raise ValueError(f'Unknown replay mode: {mode}')
+        self.source = source
+        self.mode = mode
+        self.prefetch = prefetch
+        self.workers = workers
+        self.is_video = not os.path.isdir(source)
+        self.files = [] if self.is_video else self.list_images(source)
+        if not self.is_video and not self.files:
+            raise ValueError(f'No image found in {source}')
+
+        first = self._peek()
+        self.shape = first.shape
+        self.video_fps = None
+        if self.is_video:
+            cap = cv2.VideoCapture(source)
+            self.video_fps = cap.get(cv2.CAP_PROP_FPS) or None
+            cap.release()
+        self.fps = fps or self.video_fps
+        if mode == 'fixed' and not self.fps:
+            raise ValueError('The fixed mode requires a fps')
+
+        self.last_error = ueye.IS_SUCCESS
+        self.exhausted = False
+        self.frame_idx = 0
+        self.nmb_decoded = 0
+        self.decode_seconds = 0.0
+        self.running = False
+        self.queue = Queue(maxsize=prefetch)
+        self._lock = Lock()
+        self._thread = None
+        self._start_time = None
+        self._t0 = None
+        self._ts0 = None
+        self._first_idx = 0
+
+    @staticmethod
+    def list_images(directory: str) -> List[str]:
+        """
+        Return the images of a directory tree, ordered by modification
+        time (then by name).
+        """
+        files = []
+        for root, _, names in os.walk(directory):
+            for name in names:
+                if name.lower().endswith(IMAGE_EXTENSIONS) \
+                        and not name.startswith('sample.'):
+                    files.append(os.path.join(root, name))
+
+        def key(path):
+            stem = os.path.splitext(os.path.basename(path))[0]
+            return (os.path.getmtime(path),
+                    int(stem) if stem.isdigit() else 0, path)
+        return sorted(files, key=key)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _type, value, traceback):
+        self.close()
+
+    @property
+    def camera(self):
+        return self
+
+    def _peek(self) -> np.ndarray:
+        if self.is_video:
+            cap = cv2.VideoCapture(self.source)
+            ret, img = cap.read()
+            cap.release()
+            if not ret:
+                raise ValueError(f'Cannot read video {self.source}')
+            return img
+        img = cv2.imread(self.files[0], cv2.IMREAD_UNCHANGED)
+        if img is None:
+            from .encoder import QoiEncoder
+            with open(self.files[0], 'rb') as f:
+                img = QoiEncoder().decode(f.read())
+        return img
+
+    def _decode(self, path: str) -> Tuple[np.ndarray, float]:
+        start = perf_counter()
+        if path.lower().endswith('.qoi'):
+            from .encoder import QoiEncoder
+            with open(path, 'rb') as f:
+                img = QoiEncoder().decode(f.read())
+        else:
+            img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        if img is None:
+            raise ValueError(f'Cannot decode {path}')
+        self._count_decode(perf_counter() - start)
+        return img, os.path.getmtime(path)
+
+    def _count_decode(self, elapsed: float) -> None:
+        with self._lock:
+            self.nmb_decoded += 1
+            self.decode_seconds += elapsed
+        metrics.observe('decode', elapsed)
+
+    def _put(self, item) -> bool:
+        while self.running:
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def _read_images(self) -> None:
+        with ThreadPoolExecutor(self.workers) as pool:
+            for path in self.files:
+                if not self._put(pool.submit(self._decode, path)):
+                    break
+
+    def _read_video(self) -> None:
+        cap = cv2.VideoCapture(self.source)
+        while self.running:
+            start = perf_counter()
+            ret, img = cap.read()
+            if not ret:
+                break
+            self._count_decode(perf_counter() - start)
+            timestamp = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+            if not self._put((img, timestamp)):
+                break
+        cap.release()
+
+    def _read(self) -> None:
+        if self.is_video:
+            self._read_video()
+        else:
+            self._read_images()
+        self._put(None)
+
+    def alloc(self) -> None:
+        pass
+
+    def capture_video(self, wait=False):
+        """
+        Start (or resume) the replay, decoding begins in the background.
+        """
+        if self._thread is None:
+            self.running = True
+            self._start_time = monotonic()
+            self._thread = Thread(target=self._read, daemon=True)
+            self._thread.start()
+        self._t0 = None
+        return ueye.IS_SUCCESS
+
+    def stop_video(self):
+        """
+        Pause the replay, the next capture_video resumes it.
+        """
+        return ueye.IS_SUCCESS
+
+    def close(self) -> None:
+        """
+        Stop the decoding thread.
+        """
+        self.running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def wait_for_next_image(
+            self,
+            timeout: Optional[int] = None
+    ) -> Optional[ReplayImageData]:
+        """
+        Return the next frame, at the replay timing.
+        Returns None if no frame was decoded in time, last_error is then
+        IS_TIMED_OUT, or once every frame has been replayed, exhausted is
+        then set and the writors stop.
+        """
+        if self.exhausted:
+            self.last_error = ueye.IS_TIMED_OUT
+            return None
+        if self._thread is None:
+            raise UEyeError(ueye.IS_NO_ACTIVE_IMG_MEM)
+        with metrics.time('wait'):
+            try:
+                item = self.queue.get(
+                    timeout=None if timeout is None else timeout / 1000)
+            except Empty:
+                self.last_error = ueye.IS_TIMED_OUT
+                metrics.inc('frames_dropped')
+                return None
+            if item is None:
+                self.exhausted = True
+                self.last_error = ueye.IS_TIMED_OUT
+                return None
+            if isinstance(item, Future):
+                try:
+                    item = item.result()
+                except ValueError as e:
+                    print(f'Warning: {e}')
+                    self.last_error = ueye.IS_NO_SUCCESS
+                    metrics.inc('frames_dropped')
+                    return None
+            img, timestamp = item
+            self._wait_timing(timestamp)
+        self.last_error = ueye.IS_SUCCESS
+        self.frame_idx += 1
+        metrics.inc('frames_captured')
+        return ReplayImageData(img, self.frame_idx, timestamp)
+
+    def _wait_timing(self, timestamp: float) -> None:
+        if self._t0 is None:
+            self._t0 = monotonic()
+            self._ts0 = timestamp
+            self._first_idx = self.frame_idx
+            return
+        if self.mode == 'original':
+            target = self._t0 + timestamp - self._ts0
+        elif self.mode == 'fixed':
+            target = self._t0 + (self.frame_idx - self._first_idx) / self.fps
+        else:
+            return
+        delay = target - monotonic()
+        if delay > 0:
+            sleep(delay)
+
+    def capture_image(self, timeout=None):
+        self.capture_video()
+        imdata = self.wait_for_next_image(timeout)
+        return None if imdata is None else imdata.as_np_image()
+
+    def capture_images(self, nmb, timeout=None):
+        self.capture_video()
+        ims = []
+        for _ in range(nmb):
+            imdata = self.wait_for_next_image(timeout)
+            ims.append(None if imdata is None else imdata.as_np_image())
+        return ims
+
+    def get_decode_fps(self) -> float:
+        """
+        Return the decoding throughput, in frames per second of decoding
+        time (summed over the workers).
+        """
+        if not self.decode_seconds:
+            return 0.0
+        return self.nmb_decoded / self.decode_seconds
+
+    def get_replay_fps(self) -> float:
+        """
+        Return the mean rate at which frames have been delivered.
+        """
+        if self._start_time is None:
+            return 0.0
+        elapsed = monotonic() - self._start_time
+        return self.frame_idx / elapsed if elapsed else 0.0
+
+    def set_fps(self, fps):
+        """
+        Replay at a fixed fps from now on.
+        """
+        self.fps = fps
+        self.mode = 'fixed'
+        self._t0 = None
+
+    def get_fps(self) -> float:
+        if self.fps:
+            return float(self.fps)
+        return 0
+
+    def get_aoi(self) -> Rect:
+        return Rect(0, 0, self.shape[1], self.shape[0])
+
+    def get_colormode(self):
+        if len(self.shape) == 2:
+            return ueye.IS_CM_MONO8
+        if self.shape[2] == 4:
+            return ueye.IS_CM_BGRA8_PACKED
+        return ueye.IS_CM_BGR8_PACKED
@@ -0,0 +1,125 @@
+import numpy as np
+from typing import Dict, Optional, Sequence, Union
+from .camera import Camera
+from .rect import Rect
+
+
+def bounding_rect(rects: Sequence[Rect]) -> Rect:
+    """
+    Return the smallest rectangle containing every rectangle.
+    """
+    if not rects:
+        raise ValueError('No rectangle given')
+    box = rects[0]
+    for rect in rects[1:]:
+        box = box.union(rect)
+    return box
+
+
+def align_rect(
+        rect: Rect,
+        x_inc: int = 1,
+        y_inc: int = 1,
+        width_inc: int = 1,
+        height_inc: int = 1,
+        max_width: Optional[int] = None,
+        max_height: Optional[int] = None
+) -> Rect:
+    """
+    Grow a rectangle so its position and size match the sensor increments
+    while still containing the original rectangle.
+    """
+    x = rect.x - rect.x % x_inc
+    y = rect.y - rect.y % y_inc
+    width = rect.right - x
+    height = rect.bottom - y
+    width += -width % width_inc
+    height += -height % height_inc
+    if max_width is not None and x + width > max_width:
+        x = max(0, max_width - width)
+        x -= x % x_inc
+        width = min(width, max_width - x)
+    if max_height is not None and y + height > max_height:
+        y = max(0, max_height - height)
+        y -= y % y_inc
+        height = min(height, max_height - y)
+    return Rect(x, y, width, height)
+
+
+class MultiRoi:
+    """
+    A set of named regions of interest sharing one sensor AOI.
+    The bounding AOI of the regions is programmed on the sensor to reduce
+    the transferred data, each region is then extracted from the frames
+    as a view, without copy.
+    """
+    def __init__(self, rois: Union[Dict[str, Rect], Sequence[Rect]]) -> None:
+        """
+        Parameters
+        ==========
+        rois: dict or list of Rect
+            Regions in sensor coordinates, a list is named '0', '1'...
+        """
+        if not isinstance(rois, dict):
+            rois = {str(i): rect for i, rect in enumerate(rois)}
+        if not rois:
+            raise ValueError('No region of interest given')
+        self.rois = dict(rois)
+        self.aoi = bounding_rect(list(self.rois.values()))
+        self._slices = {}
+        self._update_slices()
+
+    def _update_slices(self) -> None:
+        self._slices = {
+            name: rect.offset(-self.aoi.x, -self.aoi.y).slices()
+            for name, rect in self.rois.items()
+        }
+
+    def apply(self, camera: Camera) -> Rect:
+        """
+        Program the bounding AOI of the regions on the sensor.
+        Must be called before the capture is started, buffers are
+        allocated by capture_video.
+        Returns
+        =======
+        aoi: Rect
+            AOI set on the sensor, aligned on the sensor increments.
+        """
+        x_inc, y_inc, width_inc, height_inc = camera.get_aoi_increments()
+        max_width, max_height = camera.get_sensor_size()
+        aoi = align_rect(bounding_rect(list(self.rois.values())),
+                         x_inc, y_inc, width_inc, height_inc,
+                         max_width, max_height)
+        camera.set_aoi(aoi.x, aoi.y, aoi.width, aoi.height)
+        self.use_aoi(camera.get_aoi())
+        return self.aoi
+
+    def use_aoi(self, aoi: Rect) -> None:
+        """
+        Set the AOI the frames are acquired with, when it is not
+        programmed by apply.
+        Raises
+        ======
+        ValueError
+            A region is not inside the AOI.
+        """
+        for name, rect in self.rois.items():
+            if not aoi.contains(rect):
+                raise ValueError(f'ROI {name} {rect} is outside of the '
+                                f'AOI {aoi}')
+        self.aoi = aoi
+        self._update_slices()
+
+    def extract(self, img: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        Return the regions of a frame as views on the frame.
+        """
+        return {name: img[rows, cols]
+                for name, (rows, cols) in self._slices.items()}
+
+    def savings(self, sensor_width: int, sensor_height: int) -> float:
+        """
+        Return the fraction of the full frame not transferred anymore.
+        """
+        return 1 - (self.aoi.width * self.aoi.height) / \
+            (sensor_width * sensor_height)
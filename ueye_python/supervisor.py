@@ -0,0 +1,185 @@
+from pyueye import ueye
+from threading import Lock
+from time import monotonic, sleep
+from typing import Optional
+from .camera import Camera
+from .exceptions import UEyeError, is_fatal_error
+from .image_data import ImageData
+from .metrics import metrics
+
+
+class CameraSupervisor:
+    """
+    Wrapper around a Camera recovering from device and transfer failures.
+    It exposes the Camera interface and is given to the writors in place
+    of the camera. When wait_for_next_image fails with a transient error
+    (or times out too many times in a row), the camera is reinitialized,
+    its last configuration applied again and the capture restarted, with
+    a bounded exponential backoff. The writor loop never sees the failure,
+    so its queued frames are kept. Fatal errors are raised.
+    """
+    def __init__(
+            self,
+            camera: Camera,
+            max_timeouts: int = 10,
+            backoff: float = 0.5,
+            max_backoff: float = 30.0,
+            max_attempts: Optional[int] = None
+    ) -> None:
+        """
+        Parameters
+        ==========
+        camera: Camera
+            Opened camera to supervise.
+        max_timeouts: int
+            Number of consecutive timeouts (or capture errors) considered
+            as a lost device.
+        backoff: float
+            Delay before the second reconnection attempt, in seconds, it
+            doubles after every failed attempt.
+        max_backoff: float
+            Maximal delay between two attempts, in seconds.
+        max_attempts: int
+            Attempts before giving up (raising the last error), None to
+            retry forever.
+        """
+        self.cam = camera
+        self.max_timeouts = max_timeouts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self.capturing = False
+        self._wait = False
+        self._last_frame_time = monotonic()
+        self.nmb_timeouts = 0
+        self.nmb_capture_errors = 0
+        self.nmb_recoveries = 0
+        self.downtime = 0.0
+        self.last_recovery_time = None
+        self._lock = Lock()
+
+    def __getattr__(self, name):
+        # Everything else is delegated to the supervised camera
+        return getattr(self.cam, name)
+
+    def __setattr__(self, name, value):
+        # Camera state (config, format_catalog...) is written through, so
+        # the camera and its users see the same values
+        cam = self.__dict__.get('cam')
+        if cam is not None and name not in self.__dict__ \
+                and hasattr(cam, name):
+            setattr(cam, name, value)
+        else:
+            object.__setattr__(self, name, value)
+
+    def __enter__(self):
+        self.cam.__enter__()
+        return self
+
+    def __exit__(self, _type, value, traceback):
+        self.capturing = False
+        return self.cam.__exit__(_type, value, traceback)
+
+    def capture_video(self, wait=False):
+        self.capturing = True
+        self._wait = wait
+        self._last_frame_time = monotonic()
+        return self.cam.capture_video(wait)
+
+    def stop_video(self):
+        self.capturing = False
+        return self.cam.stop_video()
+
+    def wait_for_next_image(
+            self,
+            timeout: Optional[int] = None
+    ) -> Optional[ImageData]:
+        """
+        Wait for the next frame, recovering the camera when needed.
+        Returns
+        =======
+        imdata: ImageData
+            Locked frame, or None if no frame was received (timeout or
+            recovered failure).
+        Raises
+        ======
+        UEyeError
+            Fatal error, or recovery abandoned after max_attempts.
+        """
+        try:
+            imdata = self.cam.wait_for_next_image(timeout)
+        except UEyeError as e:
+            error = e.error_code
+            imdata = None
+        else:
+            error = self.cam.last_error
+        if imdata is not None:
+            self.nmb_timeouts = 0
+            self.nmb_capture_errors = 0
+            self._last_frame_time = monotonic()
+            return imdata
+        if error == ueye.IS_TIMED_OUT:
+            self.nmb_timeouts += 1
+            if self.nmb_timeouts < self.max_timeouts:
+                return None
+        elif error == ueye.IS_CAPTURE_STATUS:
+            # Transfer failure or no free buffer, clearing the capture
+            # status is enough unless it keeps happening
+            self.nmb_capture_errors += 1
+            metrics.inc('capture_errors')
+            if self.nmb_capture_errors < self.max_timeouts:
+                try:
+                    self.cam.reset_capture_status()
+                    return None
+                except UEyeError as e:
+                    print(f'Warning: cannot reset the capture status ({e})')
+        elif is_fatal_error(error):
+            raise UEyeError(error)
+        if self.capturing:
+            self.recover(error)
+        return None
+
+    def recover(self, error=None) -> None:
+        """
+        Reinitialize the camera until it works again.
+        Raises
+        ======
+        UEyeError
+            Fatal error, or recovery abandoned after max_attempts.
+        """
+        with self._lock:
+            start = monotonic()
+            print(f'Warning: camera failure ({UEyeError(error)}), '
+                  f'reconnecting')
+            metrics.inc('camera_failures')
+            delay = self.backoff
+            attempt = 0
+            while True:
+                attempt += 1
+                try:
+                    self.cam.reconnect()
+                    if self.capturing:
+                        self.cam.capture_video(self._wait)
+                    break
+                except UEyeError as e:
+                    if e.is_fatal or (self.max_attempts is not None
+                                      and attempt >= self.max_attempts):
+                        raise
+                    print(f'Warning: reconnection attempt {attempt} failed '
+                          f'({e}), next one in {delay:.1f}s')
+                sleep(delay)
+                delay = min(delay * 2, self.max_backoff)
+            now = monotonic()
+            elapsed = now - start
+            self.nmb_timeouts = 0
+            self.nmb_capture_errors = 0
+            self.nmb_recoveries += 1
+            self.last_recovery_time = elapsed
+            # Downtime counts from the last frame received
+            self.downtime += now - self._last_frame_time
+            self._last_frame_time = now
+            metrics.inc('camera_recoveries')
+            metrics.observe('recovery', elapsed)
+            metrics.set_gauge('camera_downtime_seconds', self.downtime)
+            print(f'Camera recovered in {elapsed:.2f}s '
+                  f'after {attempt} attempt(s)')
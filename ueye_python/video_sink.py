@@ -0,0 +1,220 @@
+import subprocess
+import numpy as np
+from fractions import Fraction
+from queue import Queue, Full
+from threading import Lock, Thread
+from typing import List, Optional, Union
+from .metrics import metrics
+
+
+class FFmpegVideoSink:
+    """
+    Video sink streaming raw frames to an ffmpeg subprocess over a pipe.
+    """
+    CODECS = {
+        'h264': 'libx264',
+        'h265': 'libx265',
+        'ffv1': 'ffv1',
+    }
+    PIXEL_FORMATS = {
+        1: 'gray',
+        3: 'bgr24',
+        4: 'bgra',
+    }
+
+    def __init__(
+            self,
+            path: str,
+            width: int,
+            height: int,
+            fps: Union[float, Fraction],
+            channels: int = 3,
+            codec: str = 'h264',
+            preset: str = 'veryfast',
+            crf: Optional[int] = None,
+            threads: int = 0,
+            queue_size: int = 64,
+            block: bool = True,
+            ffmpeg: str = 'ffmpeg'
+    ) -> None:
+        """
+        Parameters
+        ==========
+        path: str
+            Output video file.
+        width, height: int
+            Size of the frames.
+        fps: float or Fraction
+            Frame rate, kept as an exact fraction (29.97 -> 2997/100).
+        channels: int
+            1 for mono, 3 for BGR, 4 for BGRA frames.
+        codec: str
+            'h264', 'h265' or 'ffv1' (lossless).
+        preset: str
+            x264/x265 preset, ignored by ffv1.
+        crf: int
+            x264/x265 constant rate factor, None keeps the codec default.
+        threads: int
+            Number of encoder threads, 0 to use every core.
+        queue_size: int
+            Maximal number of frames waiting for the encoder.
+        block: bool
+            When the queue is full, wait (True) or drop the frame (False).
+        ffmpeg: str
+            Path to the ffmpeg executable.
+        """
+        if codec not in self.CODECS:
+            raise ValueError(f'Unknown codec: {codec}')
+        if channels not in self.PIXEL_FORMATS:
+            raise ValueError(f'Unsupported number of channels: {channels}')
+        self.path = path
+        self.width = width
+        self.height = height
+        self.fps = Fraction(fps).limit_denominator(1001000)
+        self.channels = channels
+        self.codec = codec
+        self.preset = preset
+        self.crf = crf
+        self.threads = threads
+        self.queue_size = queue_size
+        self.block = block
+        self.ffmpeg = ffmpeg
+        self.frame_size = width * height * channels
+        self.nmb_written = 0
+        self.nmb_dropped = 0
+        self.max_depth = 0
+        self.error = None
+        self.stderr = ''
+        self.closed = False
+        self._lock = Lock()
+
+        self.queue = Queue(maxsize=queue_size)
+        self.process = subprocess.Popen(self.command(),
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.DEVNULL,
+                                        stderr=subprocess.PIPE)
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def command(self) -> List[str]:
+        """
+        Return the ffmpeg command line.
+        """
+        cmd = [self.ffmpeg, '-hide_banner', '-loglevel', 'error', '-y',
+               '-f', 'rawvideo',
+               '-pix_fmt', self.PIXEL_FORMATS[self.channels],
+               '-s', f'{self.width}x{self.height}',
+               '-framerate', f'{self.fps.numerator}/{self.fps.denominator}',
+               '-i', 'pipe:0',
+               '-c:v', self.CODECS[self.codec],
+               '-threads', str(self.threads)]
+        if self.codec == 'ffv1':
+            cmd += ['-level', '3', '-slices', '16', '-g', '1']
+        else:
+            cmd += ['-preset', self.preset, '-pix_fmt', 'yuv420p']
+            if self.crf is not None:
+                cmd += ['-crf', str(self.crf)]
+            if self.codec == 'h265' and self.threads:
+                cmd += ['-x265-params', f'pools={self.threads}']
+        cmd.append(self.path)
+        return cmd
+
+    @property
+    def depth(self) -> int:
+        """
+        Number of frames waiting for the encoder.
+        """
+        return self.queue.qsize()
+
+    @property
+    def is_lagging(self) -> bool:
+        """
+        True when the encoder falls behind (queue more than half full
+        or frames already dropped).
+        """
+        return self.nmb_dropped > 0 or self.depth > self.queue_size // 2
+
+    def write(self, img: np.ndarray) -> bool:
+        """
+        Queue a frame for the encoder.
+        The array is sent as is, it must not be modified afterwards.
+        Returns
+        =======
+        queued: bool
+            False if the frame has been dropped, or the sink closed.
+        """
+        if self.error is not None:
+            raise self.error
+        if img.size * img.itemsize != self.frame_size:
+            raise ValueError(f'Frame of shape {img.shape} does not match '
+                             f'{self.width}x{self.height}x{self.channels}')
+        # The lock keeps frames from being queued behind the end marker,
+        # the writing thread is still draining while it is held
+        with self._lock:
+            if self.closed:
+                return False
+            try:
+                self.queue.put(img, block=self.block)
+            except Full:
+                self.nmb_dropped += 1
+                metrics.inc('video_frames_dropped')
+                return False
+        depth = self.queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+        metrics.set_gauge('video_queue_depth', depth)
+        return True
+
+    def _run(self) -> None:
+        stdin = self.process.stdin
+        while True:
+            img = self.queue.get()
+            if img is None:
+                break
+            if self.error is not None:
+                # ffmpeg is gone, keep draining so writers never block
+                continue
+            try:
+                data = memoryview(np.ascontiguousarray(img)).cast('B')
+                with metrics.time('video_write'):
+                    stdin.write(data)
+            except (BrokenPipeError, OSError) as e:
+                self.error = e
+                continue
+            self.nmb_written += 1
+        try:
+            stdin.close()
+        except OSError:
+            pass
+
+    def close(self) -> int:
+        """
+        Flush the queued frames and wait for ffmpeg to finish, its error
+        output is kept in stderr. Can be called several times.
+        Returns
+        =======
+        returncode: int
+            ffmpeg exit code.
+        """
+        with self._lock:
+            if not self.closed:
+                self.closed = True
+                self.queue.put(None)
+        self.thread.join()
+        if self.process.returncode is None:
+            # stdin is already closed by the writing thread, communicate
+            # would fail flushing it
+            err = self.process.stderr.read()
+            self.process.stderr.close()
+            self.process.wait()
+            self.stderr = err.decode(errors='replace').strip()
+            if self.process.returncode != 0:
+                print(f'Warning: ffmpeg exited with code '
+                      f'{self.process.returncode}: {self.stderr}')
+        return self.process.returncode
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _type, value, traceback):
+        self.close()
@@ -1,13 +1,19 @@
-from pyueye import ueye
 from threading import Thread
 from .camera import Camera
-from .image_buffer import ImageBuffer
 from .image_data import ImageData
+from .encoder import Encoder, get_encoder
+from .video_sink import FFmpegVideoSink
+from .metrics import metrics
+from .preview import PreviewStream
+from .roi import MultiRoi
+from .metadata import MetadataLog
+from .utils import get_bits_per_pixel
 import os
 import cv2
 import numpy as np
 from datetime import datetime
 import hashlib
+from typing import Dict, Optional
 
 
 # nmb_frames = 3000
@@ -28,34 +34,54 @@ class GatherThread(Thread):
     def __init__(
             self, 
             camera: Camera, 
-            copy=True):
+            copy=True,
+            metadata: Optional[MetadataLog] = None):
         """
         Thread used for gather images.
+        Parameters
+        ==========
+        metadata: MetadataLog
+            Log receiving a record for every frame.
         """
         super().__init__()
         self.timeout = 1000
         self.cam = camera
         self.running = True
         self.copy = copy
+        self.observers = []
+        self.metadata = metadata
 
         self.cam.capture_video()
 
     def run(self):
         while self.running:
-            img_buffer = ImageBuffer()
-            ret = ueye.is_WaitForNextImage(self.cam.camera,
-                                           self.__get_timeout(),
-                                           img_buffer.mem_ptr,
-                                           img_buffer.mem_id)
-            if ret == ueye.IS_SUCCESS:
-                imdata = ImageData(self.cam.camera, img_buffer)
+            imdata = self.cam.wait_for_next_image(self.__get_timeout())
+            if imdata is not None:
                 self._process(imdata)
+                if self.metadata is not None:
+                    self.metadata.log_frame(self.cam, imdata)
+                imdata.unlock()
+            elif self.cam.exhausted:
+                # End of a replayed recording
+                self.stop()
 
     def process(self, image_data: ImageData):
         pass
 
+    def add_observer(self, observer) -> None:
+        """
+        Offer every frame to an object with a non blocking
+        offer(np.ndarray) method (PreviewStream, ExposureController...).
+        """
+        self.observers.append(observer)
+
     def _process(self, image_data: ImageData):
-        self.process(image_data)
+        with metrics.time('process'):
+            self.process(image_data)
+        if self.observers:
+            img = image_data.as_np_image()
+            for observer in self.observers:
+                observer.offer(img)
     
     def __get_timeout(self):
         fps = self.cam.get_fps()
@@ -74,16 +100,53 @@ class VieoWritor(GatherThread):
                 path: str, 
                 duration: int, 
                 copy=True,
+                codec: Optional[str] = None,
+                preset: str = 'veryfast',
+                crf: Optional[int] = None,
+                threads: int = 0,
+                queue_size: int = 64,
+                metadata: Optional[MetadataLog] = None
             ):
         """
         Thread used to record videos.
+        Parameters
+        ==========
+        codec: str
+            None to keep the frames in memory and write a MJPG video with
+            OpenCV on stop, 'h264', 'h265' or 'ffv1' to stream them to
+            ffmpeg while recording (see FFmpegVideoSink).
+        preset, crf, threads, queue_size:
+            FFmpegVideoSink parameters, only used with a codec.
+        metadata: MetadataLog
+            Log receiving a record for every frame.
         """
-        super().__init__(camera=camera, copy=copy)
-        self.fps = int(self.cam.get_fps())
+        super().__init__(camera=camera, copy=copy, metadata=metadata)
+        self.exact_fps = float(self.cam.get_fps())
+        self.fps = int(self.exact_fps)
         self.nmb_frame = duration * self.fps
         self.ind_frame = 0
         self.path = path
         self.in_memory_images = []
+        self.codec = codec
+        self.sink = None
+        # Error of the video encoder, if it failed during the recording
+        self.error = None
+        if codec is not None:
+            aoi = self.cam.get_aoi()
+            bpp = get_bits_per_pixel(self.cam.get_colormode())
+            self.nmb_frame = int(round(duration * self.exact_fps))
+            self.sink = FFmpegVideoSink(
+                path,
+                aoi.width,
+                aoi.height,
+                self.exact_fps,
+                channels=(7 + bpp) // 8,
+                codec=codec,
+                preset=preset,
+                crf=crf,
+                threads=threads,
+                queue_size=queue_size
+            )
 
     def open_video_writer(self):
         aoi = self.cam.get_aoi()
@@ -96,17 +159,154 @@ class VieoWritor(GatherThread):
         return vwriter
     
     def process(self, imdata: ImageData):
-        self.in_memory_images.append(imdata.as_np_image())
+        if self.sink is not None:
+            try:
+                self.sink.write(imdata.as_np_image())
+            except OSError as e:
+                # ffmpeg died, stop the recording instead of the thread
+                print(f'Error: video encoder failed ({e}), '
+                      f'stopping the recording')
+                self.error = e
+                self.stop()
+                return
+            if self.sink.is_lagging:
+                metrics.inc('video_encoder_lagging')
+        else:
+            self.in_memory_images.append(imdata.as_np_image())
         self.ind_frame += 1
         if self.ind_frame >= self.nmb_frame:
             self.stop()
 
     def stop(self):
-        vw = self.open_video_writer()
-        for img in self.in_memory_images:
-            vw.write(img)
-        vw.release()
+        # Stop the acquisition first, so no frame is written once the
+        # video is being finalized
         super().stop()
+        if self.sink is not None:
+            self.sink.close()
+            if self.sink.nmb_dropped:
+                print(f'Warning: {self.sink.nmb_dropped} frames dropped, '
+                      f'the encoder was too slow')
+        else:
+            vw = self.open_video_writer()
+            for img in self.in_memory_images:
+                with metrics.time('video_write'):
+                    vw.write(img)
+            vw.release()
+
+
+class DualStreamWritor(GatherThread):
+    def __init__(
+            self,
+            camera: Camera,
+            sink,
+            preview: Optional[PreviewStream] = None,
+            copy=True,
+            metadata: Optional[MetadataLog] = None
+    ):
+        """
+        Thread feeding every frame to a recording sink and a decimated
+        copy to a preview stream running on its own worker.
+        Parameters
+        ==========
+        sink: object with a write(np.ndarray) method
+            Full rate recording sink, FFmpegVideoSink for example.
+        preview: PreviewStream
+            Preview worker, default to a quarter size, 10 fps preview.
+        metadata: MetadataLog
+            Log receiving a record for every frame.
+        """
+        super().__init__(camera=camera, copy=copy, metadata=metadata)
+        self.sink = sink
+        if preview is None:
+            preview = PreviewStream(max_fps=10, scale=0.25)
+        self.preview = preview
+
+    def start(self):
+        if not self.preview.is_alive():
+            self.preview.start()
+        super().start()
+
+    def process(self, imdata: ImageData):
+        img = imdata.as_np_image()
+        self.sink.write(img)
+        self.preview.offer(img)
+
+    def stop(self):
+        super().stop()
+        self.preview.stop()
+
+
+class ImageSink:
+    def __init__(
+            self,
+            save_dir: str,
+            save_format: str = 'jpg',
+            encoder: Optional[Encoder] = None
+    ) -> None:
+        """
+        Sink saving every written image in a directory, named by index.
+        Parameters
+        ==========
+        encoder: Encoder
+            Image encoder, default to get_encoder(save_format).
+        """
+        if encoder is None:
+            encoder = get_encoder(save_format)
+        self.encoder = encoder
+        self.save_dir = save_dir
+        self.idx = 0
+        if not os.path.exists(self.save_dir):
+            os.makedirs(self.save_dir)
+
+    def write(self, img: np.ndarray) -> None:
+        save_path = os.path.join(
+            self.save_dir,
+            str(self.idx) + '.' + self.encoder.extension
+        )
+        self.encoder.save(save_path, img)
+        self.idx += 1
+
+
+class RoiWritor(GatherThread):
+    def __init__(
+            self,
+            camera: Camera,
+            rois: MultiRoi,
+            sinks: Dict[str, object],
+            apply_aoi: bool = True,
+            copy=True,
+            metadata: Optional[MetadataLog] = None
+    ):
+        """
+        Thread splitting every frame into regions of interest, each one
+        written to its own sink as a view on the frame.
+        Parameters
+        ==========
+        rois: MultiRoi
+            Regions to extract.
+        sinks: dict
+            Region name -> object with a write(np.ndarray) method
+            (ImageSink, FFmpegVideoSink...). Regions without sink are
+            ignored.
+        apply_aoi: bool
+            Program the bounding AOI of the regions on the sensor (True)
+            or use the current AOI (False).
+        metadata: MetadataLog
+            Log receiving a record for every frame.
+        """
+        # The AOI must be set before capture_video allocates the buffers
+        if apply_aoi:
+            rois.apply(camera)
+        else:
+            rois.use_aoi(camera.get_aoi())
+        super().__init__(camera=camera, copy=copy, metadata=metadata)
+        self.rois = rois
+        self.sinks = sinks
+
+    def process(self, imdata: ImageData):
+        regions = self.rois.extract(imdata.as_np_image())
+        for name, sink in self.sinks.items():
+            sink.write(regions[name])
 
 
 class CliWritor:
@@ -116,8 +316,24 @@ class CliWritor:
         bg_image: np.ndarray,
         save_dir: str,
         save_format: str = 'jpg',
-        copacity: int = 100000
+        copacity: int = 100000,
+        encoder: Optional[Encoder] = None,
+        metadata: Optional[MetadataLog] = None
     ) -> None:
+        """
+        Parameters
+        ==========
+        encoder: Encoder
+            Image encoder, default to get_encoder(save_format).
+        metadata: MetadataLog
+            Log receiving a record for every frame, with the saved file
+            name (empty for empty frames) and the emptiness score.
+        """
+        if encoder is None:
+            encoder = get_encoder(save_format)
+        self.encoder = encoder
+        save_format = encoder.extension
+        self.metadata = metadata
         self.cam = camera
         self.idx = 1
         self.dir_idx = 1
@@ -127,6 +343,8 @@ class CliWritor:
         self.save_dir = os.path.join(self.base_dir, self.current_date, str(self.dir_idx))
         self.save_format = save_format
         self.bg_image = bg_image
+        self.running = False
+        self.observers = []
 
         if not os.path.exists(self.base_dir):
             os.makedirs(self.base_dir)
@@ -140,8 +358,8 @@ class CliWritor:
 
     def write(self) -> None:
         self.cam.capture_video()
-        img_buffer = ImageBuffer()
-        while True:
+        self.running = True
+        while self.running:
             if self.idx % self.copacity == 0:
                 print(f'Processed {self.idx * self.dir_idx} frames')
                 self.dir_idx += 1
@@ -169,36 +387,64 @@ class CliWritor:
                 if not os.path.exists(self.save_dir):
                     os.makedirs(self.save_dir)
             
-            ret = ueye.is_WaitForNextImage(
-                self.cam.camera,
-                self.__get_timeout(),
-                img_buffer.mem_ptr,
-                img_buffer.mem_id
-            )
+            img_data = self.cam.wait_for_next_image(self.__get_timeout())
 
-            if ret == ueye.IS_SUCCESS:
-                img_data = ImageData(self.cam.camera, img_buffer)
+            if img_data is not None:
                 img = img_data.as_np_image()
+                if self.metadata is not None:
+                    img_data.read_info()
                 img_data.unlock()
+                for observer in self.observers:
+                    observer.offer(img)
                 
-                if not self.__is_empty_image(img):
-                    name = hashlib.md5(img).hexdigest()
-                    save_path = os.path.join(
-                        self.save_dir, 
-                        str(name) + '.' + self.save_format
-                    )
-                    cv2.imwrite(save_path, img)
+                with metrics.time('empty_check'):
+                    is_empty, score = self.__is_empty_image(img)
+                file_name = ''
+                if not is_empty:
+                    with metrics.time('hash'):
+                        name = hashlib.md5(img).hexdigest()
+                    file_name = str(name) + '.' + self.save_format
+                    save_path = os.path.join(self.save_dir, file_name)
+                    self.encoder.save(save_path, img)
                     self.idx += 1
+                else:
+                    metrics.inc('frames_empty')
+                if self.metadata is not None:
+                    self.metadata.log_frame(
+                        self.cam,
+                        img_data,
+                        name=os.path.relpath(
+                            os.path.join(self.save_dir, file_name),
+                            self.base_dir) if file_name else '',
+                        emptiness=score
+                    )
 
                 if self.idx % self.copacity == 0:
                     save_path = os.path.join(
                         self.base_dir, 
                         'sample.' + self.save_format
                     )
-                    cv2.imwrite(save_path, img)
+                    self.encoder.save(save_path, img)
+            elif self.cam.exhausted:
+                # End of a replayed recording
+                self.stop()
             else:
                 print(f'Frame dropped')
     
+    def add_observer(self, observer) -> None:
+        """
+        Offer every frame to an object with a non blocking
+        offer(np.ndarray) method (PreviewStream, ExposureController...).
+        """
+        self.observers.append(observer)
+
+    def stop(self) -> None:
+        """
+        Stop the write loop, may be called from another thread.
+        """
+        self.running = False
+        self.cam.stop_video()
+
     def __is_empty_image(self, image):
         img = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
         bg = cv2.cvtColor(self.bg_image, cv2.COLOR_BGR2GRAY)
@@ -206,7 +452,8 @@ class CliWritor:
         diff = cv2.threshold(diff, 0, 255, cv2.THRESH_OTSU)[1]
         diff = cv2.dilate(diff, None, iterations=32)
         diff = cv2.erode(diff, None, iterations=32)
-        return cv2.countNonZero(diff) < 100 or img.var() < 100
+        score = cv2.countNonZero(diff)
+        return score < 100 or img.var() < 100, score
     
     def __get_timeout(self):
         fps = self.cam.get_fps()
@@ -220,11 +467,28 @@ class ThreadWritor(Thread):
         self, 
         camera: Camera,
         save_dir: str,
-        save_format: str = 'jpg'
+        save_format: str = 'jpg',
+        encoder: Optional[Encoder] = None,
+        metadata: Optional[MetadataLog] = None
     ) -> None:
+        """
+        Parameters
+        ==========
+        encoder: Encoder
+            Image encoder, default to get_encoder(save_format).
+        metadata: MetadataLog
+            Log receiving a record for every frame, with the saved file
+            name.
+        """
         Thread.__init__(self)
+        if encoder is None:
+            encoder = get_encoder(save_format)
+        self.encoder = encoder
+        save_format = encoder.extension
+        self.metadata = metadata
         self.cam = camera
         self.is_running = True
+        self.observers = []
         self.idx = 0
         self.dir_idx = 0
         self.copacity = 100000
@@ -241,7 +505,6 @@ class ThreadWritor(Thread):
 
     def run(self) -> None:
         self.cam.capture_video()
-        img_buffer = ImageBuffer()
         while self.is_running:
             if self.idx % self.copacity == 0:
                 self.dir_idx += 1
@@ -249,26 +512,45 @@ class ThreadWritor(Thread):
                 if not os.path.exists(self.save_dir):
                     os.makedirs(self.save_dir)
             
-            ret = ueye.is_WaitForNextImage(
-                self.cam.camera,
-                self.cam.__get_timeout(),
-                img_buffer.mem_ptr,
-                img_buffer.mem_id
-            )
+            img_data = self.cam.wait_for_next_image(self.__get_timeout())
 
-            if ret == ueye.IS_SUCCESS:
-                img_data = ImageData(self.cam.camera, img_buffer)
+            if img_data is not None:
                 img = img_data.as_np_image()
+                file_name = str(self.idx) + '.' + self.save_format
+                if self.metadata is not None:
+                    self.metadata.log_frame(
+                        self.cam,
+                        img_data,
+                        name=os.path.join(str(self.dir_idx), file_name)
+                    )
                 img_data.unlock()
+                for observer in self.observers:
+                    observer.offer(img)
                 save_path = os.path.join(
                     self.save_dir, 
-                    str(self.idx) + '.' + self.save_format
+                    file_name
                 )
-                cv2.imwrite(save_path, img)
+                self.encoder.save(save_path, img)
                 self.idx += 1
+            elif self.cam.exhausted:
+                # End of a replayed recording
+                self.stop()
             else:
                 print(f'Frame dropped')
 
+    def add_observer(self, observer) -> None:
+        """
+        Offer every frame to an object with a non blocking
+        offer(np.ndarray) method (PreviewStream, ExposureController...).
+        """
+        self.observers.append(observer)
+
     def stop(self) -> None:
         self.is_running = False
-        self.cam.stop_video()
\ No newline at end of file
+        self.cam.stop_video()
+
+    def __get_timeout(self):
+        fps = self.cam.get_fps()
+        if fps == 0:
+            fps = 1
+        return int(1.5*(1/fps)+1)*1000
\ No newline at end of file